@@ -1,21 +1,35 @@
 import asyncio
+import json
 import os
+from base64 import b64decode
+from itertools import chain, islice
+from typing import Literal
 from urllib.parse import urlparse
 
+import numpy as np
 import uvicorn
-from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi import (APIRouter, FastAPI, File, Form, Query, Request, Response,
+                     UploadFile)
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from jobs import (JobKind, JobScheduler, merge_evaluation, merge_summarization,
+                  split_evaluation, split_summarization)
 from plugin_watcher import PluginWatcher
 from pydantic import AnyHttpUrl, BaseModel, Field, root_validator, validator
 from pymongo import MongoClient
 from utils.article_download import download_article
+from utils.blob_store import blob_store_from_env
 from utils.cancel import cancel_on_disconnect
-from utils.pdf import Grobid, GrobidError
-from utils.request import request
-from utils.semantic import semantic_similarity
-from utils.sentence import sentence_split
+from utils.coalesce import SingleFlight, content_hash
+from utils.columnar import (MEDIA_TYPES, STREAM_SCHEMA, TableStream,
+                            evaluation_table, scores_table, serialize,
+                            stream_rows, summary_table)
+from utils.jsonl import LineError, dump_line, iter_line_chunks, parse_example
+from utils.pdf import Grobid, GrobidError, sections_to_text
+from utils.semantic import semantic_similarity, semantic_similarity_multiple
+from utils.sentence import sentence_split_batch, splitter
+from utils.statistics import aggregate_scores
 
 
 def is_url(url):
@@ -63,13 +77,33 @@ def error_to_message(errors):
     return errors
 
 
+def is_success(response):
+    return isinstance(response, dict) and response.get("success", False)
+
+
+single_flight = SingleFlight(
+    cache_size=int(os.environ.get("RESPONSE_CACHE_SIZE", 64)), cacheable=is_success
+)
+
+
+async def plugin_call(key, data):
+    return await single_flight.run(
+        content_hash(key, data),
+        watcher.version(key),
+        lambda: watcher.request(key, data),
+    )
+
+
 async def plugin_request(plugins):
-    keys, request_data = zip(*plugins.items())
-    responses = await request(request_data)
+    keys = list(plugins)
+    responses = await asyncio.gather(
+        *[plugin_call(key, data) for key, data in plugins.items()],
+        return_exceptions=True,
+    )
     results = {}
     errors = {}
     for key, response in zip(keys, responses):
-        if isinstance(response, dict) and response["success"]:
+        if is_success(response):
             results[key] = response["data"]
         else:
             err_messages = error_to_message(response)
@@ -78,7 +112,13 @@ async def plugin_request(plugins):
 
 
 watcher = PluginWatcher()
-grobid = Grobid(host=os.environ["GROBID_HOST"])
+blob_store = blob_store_from_env()
+grobid = Grobid(
+    hosts=os.environ["GROBID_HOST"],
+    concurrency=int(os.environ.get("GROBID_CONCURRENCY", 4)),
+    cache_size=int(os.environ.get("GROBID_CACHE_SIZE", 128)),
+    processes=int(os.environ.get("GROBID_PROCESSES", 1)),
+)
 app = FastAPI(
     openapi_url="/api/openapi.json",
     swagger_ui_oauth2_redirect_url="/api/docs/oauth2-redirect",
@@ -88,35 +128,186 @@ app = FastAPI(
 api = APIRouter()
 
 
-def split(values, num_parts):
-    size = len(values) // num_parts
-    return [values[i : i + size] for i in range(0, len(values), size)]
+EVALUATE_WINDOW = int(os.environ.get("EVALUATE_WINDOW", 4096))
+EVALUATE_WINDOWS_IN_FLIGHT = int(os.environ.get("EVALUATE_WINDOWS_IN_FLIGHT", 2))
 
 
-async def evaluate(metrics, hypotheses, references):
-    keys, batch = zip(*hypotheses.items())
-    batch = [e for hyps in batch for e in zip(hyps, references)]
-    request_args = {
-        key: {
-            "url": watcher.metrics[key]["url"],
-            "json": {"batch": batch, **args},
-        }
-        for key, args in metrics.items()
+class PluginResponseError(Exception):
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
+
+
+def model_slices(values, num_models):
+    size = len(values) // num_models if num_models else 0
+    return [values[i * size : (i + 1) * size] for i in range(num_models)]
+
+
+def iter_pairs(hypotheses, references):
+    for hyps in hypotheses.values():
+        yield from zip(hyps, references)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def store_scores(scores, offset, values):
+    """
+    writes the scores of a window into the preallocated array, if a plugin
+    returns something else than numbers the array is converted to an object
+    array
+    """
+    if scores.dtype != object and not all(is_number(value) for value in values):
+        scores = scores.astype(object)
+    if scores.dtype == object:
+        for i, value in enumerate(values):
+            scores[offset + i] = value
+    else:
+        scores[offset : offset + len(values)] = values
+    return scores
+
+
+async def evaluate_metric(key, args, hypotheses, references):
+    """
+    sends the (hypothesis, reference) pairs of all models in windows of
+    EVALUATE_WINDOW pairs to the metric with at most
+    EVALUATE_WINDOWS_IN_FLIGHT windows in flight, so that only a bounded part
+    of the corpus is serialized at any time
+    """
+    total = len(hypotheses) * len(references)
+    scores = np.empty(total, dtype=np.float64)
+    pairs = iter_pairs(hypotheses, references)
+    semaphore = asyncio.Semaphore(EVALUATE_WINDOWS_IN_FLIGHT)
+
+    async def run_window(offset, window):
+        nonlocal scores
+        try:
+            response = await plugin_call(key, {"batch": window, **args})
+        finally:
+            semaphore.release()
+        if not is_success(response):
+            raise PluginResponseError(response)
+        values = response["data"]
+        if len(values) != len(window):
+            raise ValueError(
+                f"the metric returned {len(values)} scores for {len(window)} pairs"
+            )
+        scores = store_scores(scores, offset, values)
+
+    tasks = []
+    try:
+        for offset in range(0, total, EVALUATE_WINDOW):
+            window = list(islice(pairs, EVALUATE_WINDOW))
+            await semaphore.acquire()
+            for task in tasks:
+                if task.done():
+                    task.result()
+            tasks = [task for task in tasks if not task.done()]
+            tasks.append(asyncio.create_task(run_window(offset, window)))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return scores
+
+
+def accepts_refs(configs, key):
+    return blob_store is not None and configs.get(key, {}).get("blob_store", False)
+
+
+def group_variants(metrics):
+    """
+    metrics that are variants of the same plugin (e.g. ROUGE-1, ROUGE-2 and
+    ROUGE-L) and have the same arguments are computed with a single request,
+    returns the groups as (plugin key, arguments, [(metric key, select)])
+    """
+    groups = {}
+    for key, args in metrics.items():
+        config = watcher.metrics.get(key, {})
+        plugin_key = config.get("variant_of", key)
+        group_key = (plugin_key, json.dumps(args, sort_keys=True))
+        group = groups.setdefault(group_key, (plugin_key, args, []))
+        group[2].append((key, config.get("select")))
+    return list(groups.values())
+
+
+def select_scores(scores, select):
+    values = []
+    for value in scores:
+        for field in select:
+            value = value[field]
+        values.append(value)
+    return store_scores(np.empty(len(values), dtype=np.float64), 0, values)
+
+
+async def evaluate_flat(metrics, hypotheses, references):
+    """
+    returns the models and for every metric an array with the scores of all
+    models concatenated in the order of the models
+    """
+    keys = tuple(hypotheses)
+    groups = group_variants(metrics)
+    ref_plugins = {
+        plugin_key
+        for plugin_key, _, members in groups
+        if accepts_refs(watcher.metrics, members[0][0])
     }
-    results, errors = await plugin_request(request_args)
+    if ref_plugins:
+        refs = await blob_store.put(chain(references, *hypotheses.values()))
+        ref_hypotheses = {
+            model: [refs[text] for text in hyps] for model, hyps in hypotheses.items()
+        }
+        ref_references = [refs[text] for text in references]
+        del refs
+    responses = await asyncio.gather(
+        *[
+            evaluate_metric(plugin_key, args, ref_hypotheses, ref_references)
+            if plugin_key in ref_plugins
+            else evaluate_metric(plugin_key, args, hypotheses, references)
+            for plugin_key, args, _ in groups
+        ],
+        return_exceptions=True,
+    )
+    results = {}
+    errors = {}
+    for (_, _, members), response in zip(groups, responses):
+        for key, select in members:
+            if isinstance(response, PluginResponseError):
+                errors[key] = error_to_message(response.response)
+            elif isinstance(response, Exception):
+                errors[key] = error_to_message(response)
+            elif select is None:
+                results[key] = response
+            else:
+                try:
+                    results[key] = select_scores(response, select)
+                except (KeyError, IndexError, TypeError) as e:
+                    errors[key] = error_to_message(e)
+    return keys, {key: results[key] for key in metrics if key in results}, errors
+
+
+async def evaluate(metrics, hypotheses, references):
+    keys, results, errors = await evaluate_flat(metrics, hypotheses, references)
     results = {
-        key: {k: v for k, v in zip(keys, split(value, len(keys)))}
+        key: {k: v.tolist() for k, v in zip(keys, model_slices(value, len(keys)))}
         for key, value in results.items()
     }
     return results, errors
 
 
 async def summarize(summarizers, documents, ratio):
+    batches = {key: documents for key in summarizers}
+    ref_summarizers = [
+        key for key in summarizers if accepts_refs(watcher.summarizers, key)
+    ]
+    if ref_summarizers:
+        refs = await blob_store.put(documents)
+        ref_documents = [refs[text] for text in documents]
+        batches.update({key: ref_documents for key in ref_summarizers})
     request_args = {
-        key: {
-            "url": watcher.summarizers[key]["url"],
-            "json": {"batch": documents, "ratio": ratio, **args},
-        }
+        key: {"batch": batches[key], "ratio": ratio, **args}
         for key, args in summarizers.items()
     }
     results, errors = await plugin_request(request_args)
@@ -129,6 +320,13 @@ def startup_db_client():
     app.database = app.mongodb_client["Feedbacks"]
 
 
+# registered before the db client shutdown, so that no chunk is written to a
+# closed client
+@app.on_event("shutdown")
+async def shutdown_jobs():
+    await jobs.shutdown()
+
+
 @app.on_event("shutdown")
 def shutdown_db_client():
     app.mongodb_client.close()
@@ -140,8 +338,32 @@ async def startup_event():
 
 
 @app.on_event("shutdown")
-def shutdown_db_client():
-    watcher.shutdown()
+async def shutdown_event():
+    await watcher.shutdown()
+
+
+@app.on_event("shutdown")
+def shutdown_sentence_splitter():
+    splitter.shutdown()
+
+
+@app.on_event("shutdown")
+async def shutdown_grobid():
+    await grobid.close()
+
+
+@app.on_event("startup")
+async def startup_blob_store():
+    if blob_store is not None and blob_store.max_age:
+        app.blob_store_gc = asyncio.create_task(
+            blob_store.collect_garbage(blob_store.max_age / 4)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_blob_store():
+    if getattr(app, "blob_store_gc", None) is not None:
+        app.blob_store_gc.cancel()
 
 
 @api.get("/metrics")
@@ -154,6 +376,32 @@ async def summarizers():
     return watcher.summarizers
 
 
+@api.get("/statistics")
+async def statistics():
+    return {"replicas": watcher.statistics(), "hedging": watcher.hedging()}
+
+
+class AggregateOptions(BaseModel):
+    resamples: int = Field(
+        1000,
+        ge=0,
+        le=100000,
+        description="Number of bootstrap resamples for the confidence intervals and the paired bootstrap test.",
+    )
+    permutations: int = Field(
+        1000,
+        ge=0,
+        le=100000,
+        description="Number of random sign flips for the paired permutation test.",
+    )
+    confidence: float = Field(
+        0.95, gt=0.0, lt=1.0, description="Confidence level of the intervals."
+    )
+    seed: int | None = Field(
+        None, description="Seed of the resampling to get reproducible results."
+    )
+
+
 class EvaluationBody(BaseModel):
     hypotheses: dict[str, list[str]] = Field(
         ...,
@@ -173,6 +421,11 @@ class EvaluationBody(BaseModel):
         description="The selection of metrics where each key is the name of the model and each value is a dictionary that contains the arguments for the model",
         example={"metric-null-rouge": {}},
     )
+    aggregate: AggregateOptions | None = Field(
+        None,
+        description="If given, the response additionally contains the mean, median, standard deviation and a bootstrap confidence interval for every metric and model ('aggregates') and paired significance tests between all models of a metric ('comparisons').",
+        example={"resamples": 1000, "permutations": 1000, "confidence": 0.95},
+    )
 
     @root_validator
     def same_length(cls, values):
@@ -197,16 +450,161 @@ class EvaluationBody(BaseModel):
         return v
 
 
+ResultFormat = Literal["json", "arrow", "parquet"]
+FORMAT_DESCRIPTION = "Return the results as json or as a table with one row per example in the arrow ipc stream or the parquet format. Errors and other additional data are stored as json in the metadata of the table schema."
+
+
+async def columnar_response(format, build_table, metadata={}):
+    def build():
+        return serialize(build_table(), format, metadata)
+
+    content = await asyncio.to_thread(build)
+    return Response(content=content, media_type=MEDIA_TYPES[format])
+
+
 @api.post("/evaluate")
 @cancel_on_disconnect
-async def evaluate_route(request: Request, body: EvaluationBody):
+async def evaluate_route(
+    request: Request,
+    body: EvaluationBody,
+    format: ResultFormat = Query("json", description=FORMAT_DESCRIPTION),
+):
+    if format != "json":
+        keys, results, errors = await evaluate_flat(
+            body.metrics, body.hypotheses, body.references
+        )
+        metadata = {"errors": errors}
+        if body.aggregate is not None:
+            scores = {
+                key: dict(zip(keys, model_slices(value, len(keys))))
+                for key, value in results.items()
+            }
+            metadata.update(
+                await asyncio.to_thread(
+                    aggregate_scores, scores, **body.aggregate.dict()
+                )
+            )
+        return await columnar_response(
+            format,
+            lambda: evaluation_table(keys, len(body.references), results),
+            metadata,
+        )
     results, errors = await evaluate(body.metrics, body.hypotheses, body.references)
     data = {"scores": results}
+    if body.aggregate is not None:
+        data.update(
+            await asyncio.to_thread(aggregate_scores, results, **body.aggregate.dict())
+        )
     if errors:
         data["errors"] = errors
     return {"data": data}
 
 
+def parse_metric_selection(metrics):
+    try:
+        selection = json.loads(metrics)
+    except json.JSONDecodeError:
+        selection = [key.strip() for key in metrics.split(",") if key.strip()]
+    if isinstance(selection, list):
+        selection = {key: {} for key in selection}
+    if not isinstance(selection, dict) or not selection:
+        raise ValueError(
+            "metrics has to be a json object or a comma separated list of metrics"
+        )
+    unknown = [key for key in selection if key not in watcher.metric_keys]
+    if unknown:
+        raise ValueError(f"unknown metrics: {unknown}")
+    return selection
+
+
+async def evaluate_lines(metrics, lines, first_line):
+    output = [None] * len(lines)
+    groups = {}
+    for i, line in enumerate(lines):
+        try:
+            hypotheses, reference = parse_example(line)
+        except LineError as e:
+            output[i] = {"line": first_line + i, "error": str(e)}
+            continue
+        groups.setdefault(tuple(hypotheses), []).append((i, hypotheses, reference))
+    for models, group in groups.items():
+        indices, hypotheses, references = zip(*group)
+        hypotheses = {model: [h[model] for h in hypotheses] for model in models}
+        results, errors = await evaluate(metrics, hypotheses, list(references))
+        for j, i in enumerate(indices):
+            entry = {
+                "line": first_line + i,
+                "scores": {
+                    metric: {model: values[j] for model, values in scores.items()}
+                    for metric, scores in results.items()
+                },
+            }
+            if errors:
+                entry["errors"] = errors
+            output[i] = entry
+    return output
+
+
+async def stream_evaluation(file, metrics, chunk_size):
+    line = 0
+    try:
+        async for lines in iter_line_chunks(file, chunk_size):
+            for entry in await evaluate_lines(metrics, lines, line):
+                yield dump_line(entry)
+            line += len(lines)
+    finally:
+        file.close()
+
+
+async def stream_evaluation_table(file, metrics, chunk_size, format):
+    line = 0
+    stream = TableStream(STREAM_SCHEMA, format)
+    try:
+        async for lines in iter_line_chunks(file, chunk_size):
+            entries = await evaluate_lines(metrics, lines, line)
+            yield await asyncio.to_thread(stream.write, stream_rows(entries))
+            line += len(lines)
+        yield stream.close()
+    finally:
+        file.close()
+
+
+@api.post("/evaluate/stream")
+async def evaluate_stream_route(
+    file: UploadFile = File(
+        ...,
+        description="A jsonl file where every line is a json object with a 'reference' and one entry per model (e.g. the output of jsonl_converter.py) or a parquet file with one column per entry. The key 'document' is ignored.",
+    ),
+    metrics: str = Form(
+        ...,
+        description="A json object like the metrics of /evaluate or a comma separated list of metrics.",
+        example="metric-null-bleu,metric-null-cider",
+    ),
+    chunk_size: int = Form(
+        64, gt=0, description="Number of lines that are evaluated together."
+    ),
+    format: ResultFormat = Query(
+        "json",
+        description="Return jsonl or a table with one row per line, model and metric (columns line, model, metric, score and error) in the arrow ipc stream or the parquet format.",
+    ),
+):
+    try:
+        metrics = parse_metric_selection(metrics)
+    except ValueError as e:
+        file.file.close()
+        error = {"error": "VALIDATION", "errors": [{"loc": ["metrics"], "msg": str(e)}]}
+        return JSONResponse({"errors": error_to_message(error)}, status_code=422)
+    if format != "json":
+        return StreamingResponse(
+            stream_evaluation_table(file.file, metrics, chunk_size, format),
+            media_type=MEDIA_TYPES[format],
+        )
+    return StreamingResponse(
+        stream_evaluation(file.file, metrics, chunk_size),
+        media_type="application/x-ndjson",
+    )
+
+
 class SummarizeBody(BaseModel):
     documents: list[str] = Field(
         ...,
@@ -250,44 +648,63 @@ app.add_middleware(
 )
 
 
-async def transform_text(text, split):
-    if split:
-        if isinstance(text, str):
-            return await sentence_split(text)
-    else:
-        if not isinstance(text, str):
-            return " ".join(text)
-    return text
+async def transform_texts(texts, split):
+    if not split:
+        return [text if isinstance(text, str) else " ".join(text) for text in texts]
+    texts = list(texts)
+    indices = [i for i, text in enumerate(texts) if isinstance(text, str)]
+    splitted = await sentence_split_batch([texts[i] for i in indices])
+    for i, sentences in zip(indices, splitted):
+        texts[i] = sentences
+    return texts
 
 
-@api.post("/summarize")
-@cancel_on_disconnect
-async def summarize_route(request: Request, body: SummarizeBody):
+PDF_DATA_PREFIX = "data:application/pdf;base64,"
+
+
+async def prepare_document(text):
+    text = text.strip()
+    if text.startswith(PDF_DATA_PREFIX):
+        extracted = await grobid.extract_pdf(b64decode(text[len(PDF_DATA_PREFIX) :]))
+        return sections_to_text(extracted), {"title": extracted["title"]}
+    if is_url(text):
+        meta = await download_article(text)
+        meta["url"] = text
+        text = meta["text"]
+        del meta["text"]
+        return text, meta
+    return text, {}
+
+
+async def summarize_raw(body):
+    """
+    returns the summaries of every summarizer, the metadata of every document
+    and the errors
+    """
     documents = []
     metadata = []
     for text in body.documents:
-        text = text.strip()
-        if is_url(text):
-            meta = await download_article(text)
-            meta["url"] = text
-            text = meta["text"]
-            del meta["text"]
-        else:
-            meta = {}
+        text, meta = await prepare_document(text)
         documents.append(text)
-        if body.add_metadata:
-            meta["document"] = await transform_text(text, body.split_sentences)
         metadata.append(meta)
     results, errors = await summarize(body.summarizers, documents, body.ratio)
+    split_keys = []
     if body.split_sentences:
-        new_results = {}
-        for key, value in results.items():
-            if isinstance(value, list):
-                value = [
-                    await transform_text(text, body.split_sentences) for text in value
-                ]
-            new_results[key] = value
-        results = new_results
+        split_keys = [key for key, value in results.items() if isinstance(value, list)]
+    texts = [text for key in split_keys for text in results[key]]
+    if body.add_metadata:
+        texts = documents + texts
+    texts = iter(await transform_texts(texts, body.split_sentences))
+    if body.add_metadata:
+        for meta in metadata:
+            meta["document"] = next(texts)
+    for key in split_keys:
+        results[key] = [next(texts) for _ in results[key]]
+    return results, metadata, errors
+
+
+async def summarize_documents(body):
+    results, metadata, errors = await summarize_raw(body)
     if results:
         keys, values = list(zip(*results.items()))
     else:
@@ -299,6 +716,206 @@ async def summarize_route(request: Request, body: SummarizeBody):
             content["metadata"] = meta
         summaries.append(content)
     data = {"summaries": summaries}
+    if errors:
+        data["errors"] = errors
+    return data
+
+
+@api.post("/summarize")
+@cancel_on_disconnect
+async def summarize_route(
+    request: Request,
+    body: SummarizeBody,
+    format: ResultFormat = Query("json", description=FORMAT_DESCRIPTION),
+):
+    if format != "json":
+        results, metadata, errors = await summarize_raw(body)
+        if not body.add_metadata:
+            metadata = None
+        return await columnar_response(
+            format, lambda: summary_table(results, metadata), {"errors": errors}
+        )
+    return {"data": await summarize_documents(body)}
+
+
+async def run_evaluation_chunk(arguments, data):
+    results, errors = await evaluate(
+        arguments["metrics"], data["hypotheses"], data["references"]
+    )
+    return {"scores": results, "errors": errors}
+
+
+async def run_summarization_chunk(arguments, data):
+    return await summarize_documents(SummarizeBody.construct(**arguments, **data))
+
+
+jobs = JobScheduler(
+    {
+        "evaluate": JobKind(split_evaluation, run_evaluation_chunk, merge_evaluation),
+        "summarize": JobKind(
+            split_summarization, run_summarization_chunk, merge_summarization
+        ),
+    },
+    chunk_size=int(os.environ.get("JOB_CHUNK_SIZE", 100)),
+    num_workers=int(os.environ.get("JOB_WORKERS", 2)),
+)
+
+
+@app.on_event("startup")
+async def startup_jobs():
+    await jobs.start(app.mongodb_client["Jobs"])
+
+
+def job_not_found(job_id):
+    return JSONResponse({"errors": [f"job {job_id} does not exist"]}, status_code=404)
+
+
+@api.post("/jobs")
+async def create_job(body: EvaluationBody | SummarizeBody):
+    kind = "evaluate" if isinstance(body, EvaluationBody) else "summarize"
+    job_id = await jobs.submit(kind, body.dict())
+    return {"data": {"id": job_id}}
+
+
+def job_table(kind, data):
+    if kind == "evaluate":
+        return scores_table(data["scores"])
+    summaries = data["summaries"]
+    keys = dict.fromkeys(key for e in summaries for key in e["summaries"])
+    results = {key: [e["summaries"].get(key) for e in summaries] for key in keys}
+    metadata = None
+    if any("metadata" in e for e in summaries):
+        metadata = [e.get("metadata", {}) for e in summaries]
+    return summary_table(results, metadata)
+
+
+@api.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    results: bool = True,
+    format: ResultFormat = Query(
+        "json",
+        description=f"{FORMAT_DESCRIPTION} The status of the job is stored in the metadata as well.",
+    ),
+):
+    job = await jobs.get(job_id, with_results=results or format != "json")
+    if job is None:
+        return job_not_found(job_id)
+    if format != "json":
+        data = job.pop("data")
+        table_data = {"scores", "summaries"}
+        metadata = {key: value for key, value in data.items() if key not in table_data}
+        return await columnar_response(
+            format, lambda: job_table(job["kind"], data), {"job": job, **metadata}
+        )
+    return {"data": job}
+
+
+@api.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if await jobs.get(job_id, with_results=False) is None:
+        return job_not_found(job_id)
+    await jobs.cancel(job_id)
+    return {"data": await jobs.get(job_id, with_results=False)}
+
+
+class PipelineBody(BaseModel):
+    documents: list[str] = Field(
+        ...,
+        min_length=1,
+        description="List of documents to be summarized. An entry can also be the url of an article or a base64 encoded pdf prefixed with 'data:application/pdf;base64,'.",
+        example=["This is the first sentence.", "This is the second sentence."],
+    )
+    references: list[str] = Field(
+        ...,
+        description="A list of reference summaries, one for each document.",
+        example=["This is a reference.", "This is another reference."],
+    )
+    ratio: float = Field(
+        0.2,
+        gt=0.0,
+        lt=1.0,
+        description="The number of words in the summary will be approximately 'ratio * <number of words in document>'",
+    )
+    summarizers: dict[str, dict] = Field(
+        ...,
+        description="The selection of summarizers where each key is the name of the model and each value is a dictionary that contains the arguments for the model",
+        example={"summarizer-null-textrank": {}},
+    )
+    metrics: dict[str, dict] = Field(
+        ...,
+        description="The selection of metrics that evaluate the summaries of every summarizer against the references",
+        example={"metric-null-rouge": {}},
+    )
+
+    @root_validator
+    def same_length(cls, values):
+        documents = values.get("documents")
+        references = values.get("references")
+        if documents is None or references is None:
+            return values
+        if len(documents) != len(references):
+            raise ValueError(
+                f"documents and references are not the same size ({len(documents)} != {len(references)})"
+            )
+        return values
+
+    @validator("summarizers")
+    def valid_summarizers(cls, v):
+        unknown = [e for e in v.keys() if e not in watcher.summarizer_keys]
+        if unknown:
+            raise ValueError(f"unknown summarizers: {unknown}")
+        return v
+
+    @validator("metrics")
+    def valid_metric(cls, v):
+        unknown = [e for e in v.keys() if e not in watcher.metric_keys]
+        if unknown:
+            raise ValueError(f"unknown metrics: {unknown}")
+        return v
+
+
+def merge_errors(errors, new_errors):
+    for key, messages in new_errors.items():
+        errors.setdefault(key, []).extend(messages)
+
+
+async def summarize_and_evaluate(key, args, documents, body):
+    results, errors = await summarize({key: args}, documents, body.ratio)
+    if key not in results:
+        return {}, {}, errors
+    summaries = results[key]
+    hypotheses = {
+        key: [text if isinstance(text, str) else " ".join(text) for text in summaries]
+    }
+    scores, metric_errors = await evaluate(body.metrics, hypotheses, body.references)
+    merge_errors(errors, metric_errors)
+    return summaries, scores, errors
+
+
+@api.post("/pipeline")
+@cancel_on_disconnect
+async def pipeline_route(request: Request, body: PipelineBody):
+    prepared = await asyncio.gather(*[prepare_document(text) for text in body.documents])
+    documents = [text for text, _ in prepared]
+    outputs = await asyncio.gather(
+        *[
+            summarize_and_evaluate(key, args, documents, body)
+            for key, args in body.summarizers.items()
+        ]
+    )
+    summaries = {}
+    scores = {}
+    errors = {}
+    for key, (summarizer_summaries, summarizer_scores, summarizer_errors) in zip(
+        body.summarizers, outputs
+    ):
+        if summarizer_summaries:
+            summaries[key] = summarizer_summaries
+        for metric, metric_scores in summarizer_scores.items():
+            scores.setdefault(metric, {}).update(metric_scores)
+        merge_errors(errors, summarizer_errors)
+    data = {"summaries": summaries, "scores": scores}
     if errors:
         data["errors"] = errors
     return {"data": data}
@@ -318,11 +935,23 @@ async def pdf_extract(request: Request):
 
 class SemanticSimilarityBody(BaseModel):
     sentences: str
-    summary: str
+    summary: str | None = None
+    summaries: list[str] | None = Field(
+        None,
+        description="Compare several summaries against the same document in a single call. The response contains one entry per summary under 'summaries'.",
+    )
+
+    @root_validator
+    def summary_given(cls, values):
+        if (values.get("summary") is None) == (values.get("summaries") is None):
+            raise ValueError("provide exactly one of 'summary' and 'summaries'")
+        return values
 
 
 @api.post("/semantic_similarity")
 async def semantic_similarity_route(body: SemanticSimilarityBody):
+    if body.summaries is not None:
+        return await semantic_similarity_multiple(body.sentences, body.summaries)
     return await semantic_similarity(body.sentences, body.summary)
 
 
@@ -0,0 +1,290 @@
+import asyncio
+import time
+import uuid
+
+from pymongo import ASCENDING
+from utils.aio import to_future
+from utils.statistics import aggregate_scores
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+UNFINISHED = [PENDING, RUNNING]
+
+
+def _chunks(length, chunk_size):
+    return [(i, min(i + chunk_size, length)) for i in range(0, length, chunk_size)]
+
+
+class JobKind:
+    """
+    describes how the body of a job is split into chunks, how a chunk is
+    processed and how the results of the chunks are merged again
+    """
+
+    def __init__(self, split, run, merge):
+        self.split = split
+        self.run = run
+        self.merge = merge
+
+
+def split_evaluation(body):
+    hypotheses = body.pop("hypotheses")
+    references = body.pop("references")
+
+    def chunk(start, end):
+        return {
+            "hypotheses": {key: hyps[start:end] for key, hyps in hypotheses.items()},
+            "references": references[start:end],
+        }
+
+    return len(references), chunk
+
+
+def merge_evaluation(arguments, chunks):
+    scores = {}
+    errors = {}
+    offset = 0
+    for chunk in chunks:
+        result = chunk["result"]
+        for metric, model_scores in result["scores"].items():
+            metric_scores = scores.setdefault(metric, {})
+            for model, values in model_scores.items():
+                metric_scores.setdefault(model, [None] * offset).extend(values)
+        for metric, messages in result.get("errors", {}).items():
+            errors.setdefault(metric, []).extend(messages)
+        offset += chunk["size"]
+        for metric_scores in scores.values():
+            for values in metric_scores.values():
+                values.extend([None] * (offset - len(values)))
+    data = {"scores": scores}
+    if arguments.get("aggregate") is not None:
+        data.update(aggregate_scores(scores, **arguments["aggregate"]))
+    if errors:
+        data["errors"] = errors
+    return data
+
+
+def split_summarization(body):
+    documents = body.pop("documents")
+
+    def chunk(start, end):
+        return {"documents": documents[start:end]}
+
+    return len(documents), chunk
+
+
+def merge_summarization(arguments, chunks):
+    summaries = []
+    errors = {}
+    for chunk in chunks:
+        result = chunk["result"]
+        summaries.extend(result["summaries"])
+        for summarizer, messages in result.get("errors", {}).items():
+            errors.setdefault(summarizer, []).extend(messages)
+    data = {"summaries": summaries}
+    if errors:
+        data["errors"] = errors
+    return data
+
+
+class JobScheduler:
+    """
+    runs evaluation and summarization jobs in the background
+
+    the input of a job is split into chunks of `chunk_size` examples which are
+    stored together with their results in mongodb, so that unfinished jobs are
+    resumed with the first unfinished chunk when the gateway restarts
+    """
+
+    def __init__(self, kinds, chunk_size=100, num_workers=2):
+        self.kinds = kinds
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self.queue = asyncio.Queue()
+        self.cancelled = set()
+        self.workers = []
+
+    async def start(self, database):
+        self.jobs = database["jobs"]
+        self.chunks = database["chunks"]
+        await asyncio.to_thread(
+            self.chunks.create_index, [("job", ASCENDING), ("index", ASCENDING)]
+        )
+        unfinished = await asyncio.to_thread(
+            lambda: list(
+                self.jobs.find({"status": {"$in": UNFINISHED}}, {"_id": True}).sort(
+                    "created", ASCENDING
+                )
+            )
+        )
+        for job in unfinished:
+            self.queue.put_nowait(job["_id"])
+        self.workers = [self._work() for _ in range(self.num_workers)]
+
+    async def shutdown(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, kind, body):
+        job_id = uuid.uuid4().hex
+        size, chunk = self.kinds[kind].split(body)
+        chunks = [
+            {
+                "job": job_id,
+                "index": index,
+                "size": end - start,
+                "input": chunk(start, end),
+                "result": None,
+            }
+            for index, (start, end) in enumerate(_chunks(size, self.chunk_size))
+        ]
+        job = {
+            "_id": job_id,
+            "kind": kind,
+            "status": PENDING,
+            "arguments": body,
+            "num_items": size,
+            "done_items": 0,
+            "num_chunks": len(chunks),
+            "done_chunks": 0,
+            "processing_time": 0.0,
+            "created": time.time(),
+            "finished": None,
+        }
+        if chunks:
+            await asyncio.to_thread(self.chunks.insert_many, chunks)
+        await asyncio.to_thread(self.jobs.insert_one, job)
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def cancel(self, job_id):
+        result = await asyncio.to_thread(
+            self.jobs.update_one,
+            {"_id": job_id, "status": {"$in": UNFINISHED}},
+            {"$set": {"status": CANCELLED, "finished": time.time()}},
+        )
+        if result.modified_count:
+            self.cancelled.add(job_id)
+        return result.modified_count > 0
+
+    async def get(self, job_id, with_results=True):
+        job = await asyncio.to_thread(self.jobs.find_one, {"_id": job_id})
+        if job is None:
+            return None
+        remaining = job["num_items"] - job["done_items"]
+        eta = None
+        if job["status"] in UNFINISHED and job["done_items"]:
+            eta = job["processing_time"] / job["done_items"] * remaining
+        status = {
+            "id": job["_id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "progress": {
+                "done": job["done_items"],
+                "total": job["num_items"],
+                "eta": eta,
+            },
+            "created": job["created"],
+            "finished": job["finished"],
+        }
+        if job.get("error") is not None:
+            status["error"] = job["error"]
+        if with_results:
+            chunks = await asyncio.to_thread(
+                lambda: list(
+                    self.chunks.find(
+                        {"job": job_id, "result": {"$ne": None}},
+                        {"size": True, "result": True},
+                    ).sort("index", ASCENDING)
+                )
+            )
+            merge = self.kinds[job["kind"]].merge
+            status["data"] = await asyncio.to_thread(merge, job["arguments"], chunks)
+        return status
+
+    async def _run(self, job_id):
+        job = await asyncio.to_thread(self.jobs.find_one, {"_id": job_id})
+        if job is None or job["status"] not in UNFINISHED:
+            return
+        # a job cancelled in the meantime is not resumed, matched_count because
+        # a job resumed after a restart is already running and not modified
+        started = await asyncio.to_thread(
+            self.jobs.update_one,
+            {"_id": job_id, "status": {"$in": UNFINISHED}},
+            {"$set": {"status": RUNNING}},
+        )
+        if started.matched_count == 0:
+            return
+        kind = self.kinds[job["kind"]]
+        chunk_ids = await asyncio.to_thread(
+            lambda: [
+                chunk["_id"]
+                for chunk in self.chunks.find(
+                    {"job": job_id, "result": None}, {"_id": True}
+                ).sort("index", ASCENDING)
+            ]
+        )
+        for chunk_id in chunk_ids:
+            if job_id in self.cancelled:
+                return
+            # the job may have been cancelled by another gateway
+            current = await asyncio.to_thread(
+                self.jobs.find_one, {"_id": job_id}, {"status": True}
+            )
+            if current is None or current["status"] != RUNNING:
+                return
+            chunk = await asyncio.to_thread(self.chunks.find_one, {"_id": chunk_id})
+            start = time.monotonic()
+            result = await kind.run(job["arguments"], chunk["input"])
+            duration = time.monotonic() - start
+            await asyncio.to_thread(
+                self.chunks.update_one,
+                {"_id": chunk_id},
+                {"$set": {"result": result}},
+            )
+            await asyncio.to_thread(
+                self.jobs.update_one,
+                {"_id": job_id},
+                {
+                    "$inc": {
+                        "done_items": chunk["size"],
+                        "done_chunks": 1,
+                        "processing_time": duration,
+                    }
+                },
+            )
+        await asyncio.to_thread(
+            self.jobs.update_one,
+            {"_id": job_id, "status": RUNNING},
+            {"$set": {"status": DONE, "finished": time.time()}},
+        )
+
+    @to_future
+    async def _work(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await asyncio.to_thread(
+                    self.jobs.update_one,
+                    {"_id": job_id, "status": {"$in": UNFINISHED}},
+                    {
+                        "$set": {
+                            "status": FAILED,
+                            "error": str(e),
+                            "finished": time.time(),
+                        }
+                    },
+                )
+            finally:
+                # on every exit of _run, also for jobs cancelled while pending
+                self.cancelled.discard(job_id)
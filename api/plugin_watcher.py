@@ -1,11 +1,19 @@
 import asyncio
 import json
+import os
+import random
+import socket
+import time
 import warnings
+from collections import deque
 from pathlib import Path
+from urllib.parse import urlparse
 
+import aiohttp
 from utils.abort import aborter
 from utils.aio import to_future
 from utils.request import request
+from utils.request import timeout as request_timeout
 
 
 def filter_available(plugins):
@@ -16,50 +24,248 @@ def filter_available(plugins):
     ]
 
 
+def expand_variants(config):
+    """
+    a plugin that computes several variants of a metric in one pass (e.g.
+    ROUGE-1, ROUGE-2 and ROUGE-L) is exposed as one metric per variant with
+    the key of the plugin followed by the suffix of the variant, requests for
+    a variant are sent to the plugin `variant_of` and `select` is the path to
+    the score of the variant in the result of every example
+    """
+    variants = config.pop("variants", None)
+    if not variants:
+        return [config]
+    return [
+        {
+            **config,
+            "key": f"{config['key']}{suffix}",
+            "name": variant["name"],
+            "variant_of": config["key"],
+            "select": variant["select"],
+        }
+        for suffix, variant in variants.items()
+    ]
+
+
+class NoHealthyReplicaError(Exception):
+    pass
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = False
+        self.outstanding = 0
+        self.reported = 0
+        self.instancetag = None
+
+    def load(self):
+        # the reported statistics also contain the elements sent by this
+        # gateway, but they lag behind, so the larger value is used
+        return max(self.outstanding, self.reported)
+
+    def eject(self):
+        self.healthy = False
+
+    def admit(self, statistics):
+        self.healthy = True
+        self.reported = statistics.get("waiting elements", 0) + statistics.get(
+            "running elements", 0
+        )
+
+    def info(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "reported": self.reported,
+        }
+
+
+class LatencyTracker:
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def quantile(self, q):
+        if len(self.samples) < self.min_samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Replicas:
+    def __init__(self, key):
+        self.key = key
+        self.endpoints = {}
+        self.buildtag = None
+        self.latencies = LatencyTracker()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def update(self, urls):
+        self.endpoints = {url: self.endpoints.get(url) or Endpoint(url) for url in urls}
+
+    def healthy(self):
+        return [e for e in self.endpoints.values() if e.healthy]
+
+    def version(self):
+        instancetags = sorted(str(e.instancetag) for e in self.endpoints.values())
+        return (self.buildtag, *instancetags)
+
+    def pick(self, exclude=None, fallback=True):
+        """
+        returns the healthy replica with the least load, if all replicas are
+        ejected and `fallback` is set, the ejected replica with the least load
+        is tried anyway, because a missed poll does not mean that it is down
+        """
+        candidates = [e for e in self.healthy() if e is not exclude]
+        if not candidates and fallback:
+            candidates = [e for e in self.endpoints.values() if e is not exclude]
+        if not candidates:
+            raise NoHealthyReplicaError(f"no healthy replica for plugin {self.key}")
+        lowest = min(e.load() for e in candidates)
+        return random.choice([e for e in candidates if e.load() == lowest])
+
+    def hedging(self):
+        return {
+            "requests": self.requests,
+            "hedged": self.hedges,
+            "hedge wins": self.hedge_wins,
+            "p95 latency": self.latencies.quantile(0.95),
+        }
+
+
 class PluginWatcher:
+    """
+    keeps the plugin configurations up to date and routes requests to the plugins
+
+    every plugin in plugin_config.json is given as one url or a list of urls
+    (replicas), if `discover_replicas` is set, every url is additionally
+    expanded to all addresses its host name resolves to (e.g. a headless
+    kubernetes service or a scaled docker compose service)
+    the replicas report their load every `statistics_every` seconds and each
+    request goes to the healthy replica with the least outstanding work,
+    replicas that fail to connect are ejected until they report again, if all
+    replicas of a plugin are ejected, requests go to the least loaded one
+
+    if a request has not been answered after the 95th percentile of the
+    latencies of the plugin, a duplicate is sent to another replica (at most
+    for `hedge_ratio` of the requests), the first response wins and the
+    other request is cancelled
+    """
+
     def __init__(
         self,
         update_every=30,
+        statistics_every=2,
         timeout=2,
         config_path="/plugin_config/plugin_config.json",
+        discover_replicas=bool(os.environ.get("PLUGIN_REPLICA_DISCOVERY")),
+        hedge_ratio=float(os.environ.get("PLUGIN_HEDGE_RATIO", 0.05)),
     ):
         self.update_every = update_every
+        self.statistics_every = statistics_every
         self.timeout = timeout
         self.config_path = Path(config_path).expanduser()
+        self.discover_replicas = discover_replicas
+        self.hedge_ratio = hedge_ratio
+        self.replicas = {}
+        # key of a metric or summarizer -> key of its replicas
+        self.plugin_keys = {}
+        self.session = None
+
+    async def resolve(self, urls):
+        if not self.discover_replicas:
+            return list(urls)
+        loop = asyncio.get_running_loop()
+        resolved = []
+        for url in urls:
+            parsed = urlparse(url)
+            try:
+                infos = await loop.getaddrinfo(
+                    parsed.hostname, parsed.port or 80, type=socket.SOCK_STREAM
+                )
+            except socket.gaierror:
+                resolved.append(url)
+                continue
+            for address in sorted({info[4][0] for info in infos}):
+                netloc = f"[{address}]" if ":" in address else address
+                if parsed.port is not None:
+                    netloc = f"{netloc}:{parsed.port}"
+                resolved.append(parsed._replace(netloc=netloc).geturl())
+        return list(dict.fromkeys(resolved))
 
     async def gather_configs(self):
         raw_config = json.loads(self.config_path.read_text())
         gathered = {"summarizer": {}, "metric": {}}
-        keys, request_data = zip(
-            *[
-                (key, {"url": f"{value}/config", "timeout": self.timeout})
-                for key, value in raw_config.items()
-                if isinstance(value, str)
-            ]
-        )
-        responses = dict(zip(keys, await request(request_data)))
+        plugin_keys = {}
+        endpoint_urls = {}
+        for key, value in raw_config.items():
+            if isinstance(value, str):
+                value = [value]
+            if isinstance(value, list):
+                endpoint_urls[key] = await self.resolve(value)
+        targets = [(key, url) for key, urls in endpoint_urls.items() for url in urls]
+        responses = []
+        if targets:
+            responses = await request(
+                [{"url": f"{url}/config", "timeout": self.timeout} for _, url in targets]
+            )
+        responses = dict(zip(targets, responses))
+        self.replicas = {
+            key: self.replicas.get(key) or Replicas(key) for key in endpoint_urls
+        }
         for key, value in raw_config.items():
-            config = responses.get(key)
-            if config is None:
+            urls = endpoint_urls.get(key)
+            if urls is None:
                 config = value
                 config["disabled"] = True
-            elif isinstance(config, Exception) or not config.get("success", True):
-                config = {"disabled": False, "healthy": False, "key": key}
             else:
-                config["url"] = value
-                config["disabled"] = False
-                config["healthy"] = True
-                config_key = config["key"]
-                if key != config_key:
-                    warnings.warn(
-                        f"plugin is configured as {key} but the container has key {config_key}"
-                    )
+                replicas = self.replicas[key]
+                replicas.update(urls)
+                config = None
+                for url in urls:
+                    response = responses[(key, url)]
+                    endpoint = replicas.endpoints[url]
+                    if isinstance(response, Exception) or not response.get(
+                        "success", True
+                    ):
+                        endpoint.eject()
+                        continue
+                    endpoint.admit(response.get("statistics", {}))
+                    endpoint.instancetag = response.get("instancetag")
+                    if config is None:
+                        replicas.buildtag = response.get("buildtag")
+                        config = response
+                if config is None:
+                    config = {"disabled": False, "healthy": False, "key": key}
+                else:
+                    config["url"] = value
+                    config["replicas"] = len(replicas.healthy())
+                    config["disabled"] = False
+                    config["healthy"] = True
+                    config_key = config["key"]
+                    if key != config_key:
+                        warnings.warn(
+                            f"plugin is configured as {key} but the container has key {config_key}"
+                        )
             type_, _, name = key.split("-")[:3]
             config.setdefault("type", type_)
             config.setdefault("name", name)
             config.setdefault("metadata", {})
             gathered.setdefault(config["type"], {})
-            gathered[config["type"]][config["key"]] = config
+            # the api addresses plugins by the key of their config, which may
+            # differ from the key in the plugin config file
+            plugin_keys[config["key"]] = key
+            for config in expand_variants(config):
+                plugin_keys[config["key"]] = key
+                gathered[config["type"]][config["key"]] = config
+        self.plugin_keys = plugin_keys
         return gathered
 
     async def update(self):
@@ -69,12 +275,110 @@ class PluginWatcher:
         self.metric_keys = filter_available(self.metrics)
         self.summarizer_keys = filter_available(self.summarizers)
 
+    async def update_statistics(self):
+        endpoints = [
+            endpoint
+            for replicas in self.replicas.values()
+            for endpoint in replicas.endpoints.values()
+        ]
+        if not endpoints:
+            return
+        responses = await request(
+            [
+                {"url": f"{endpoint.url}/statistics", "timeout": self.timeout}
+                for endpoint in endpoints
+            ]
+        )
+        for endpoint, response in zip(endpoints, responses):
+            if isinstance(response, dict) and "waiting elements" in response:
+                endpoint.admit(response)
+            else:
+                endpoint.eject()
+
+    async def _post(self, endpoint, json, size):
+        endpoint.outstanding += size
+        try:
+            async with self.session.post(endpoint.url, json=json) as response:
+                return await response.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            endpoint.eject()
+            raise
+        finally:
+            endpoint.outstanding -= size
+
+    def _hedge_delay(self, replicas):
+        if self.hedge_ratio <= 0 or len(replicas.healthy()) < 2:
+            return None
+        return replicas.latencies.quantile(0.95)
+
+    def _hedge(self, replicas, endpoint, json, size):
+        if replicas.hedges >= self.hedge_ratio * replicas.requests:
+            return None
+        try:
+            other = replicas.pick(exclude=endpoint, fallback=False)
+        except NoHealthyReplicaError:
+            return None
+        replicas.hedges += 1
+        return asyncio.ensure_future(self._post(other, json, size))
+
+    def _replicas(self, key):
+        return self.replicas[self.plugin_keys.get(key, key)]
+
+    async def request(self, key, json):
+        replicas = self._replicas(key)
+        endpoint = replicas.pick()
+        size = len(json.get("batch", ()))
+        replicas.requests += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._post(endpoint, json, size))
+        tasks = [primary]
+        try:
+            delay = self._hedge_delay(replicas)
+            if delay is not None:
+                done, _ = await asyncio.wait([primary], timeout=delay)
+                if not done:
+                    hedge = self._hedge(replicas, endpoint, json, size)
+                    if hedge is not None:
+                        tasks.append(hedge)
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None:
+                    break
+                if not pending:
+                    # all requests failed, raise the error of the primary request
+                    return primary.result()
+            if winner is not primary:
+                replicas.hedge_wins += 1
+            replicas.latencies.add(time.monotonic() - start)
+            return winner.result()
+        finally:
+            # cancelling closes the connection, the plugin stops the work of
+            # the losing request when it notices the disconnect
+            for task in tasks:
+                task.cancel()
+
+    def version(self, key):
+        return self._replicas(key).version()
+
+    def statistics(self):
+        return {
+            key: [endpoint.info() for endpoint in replicas.endpoints.values()]
+            for key, replicas in self.replicas.items()
+        }
+
+    def hedging(self):
+        return {key: replicas.hedging() for key, replicas in self.replicas.items()}
+
     @to_future
-    async def update_loop(self):
+    async def _loop(self, func, interval):
         try:
             while True:
-                await asyncio.sleep(self.update_every)
-                await self.update()
+                await asyncio.sleep(interval)
+                await func()
         except asyncio.CancelledError:
             raise
         except Exception as e:
@@ -83,10 +387,16 @@ class PluginWatcher:
             )
 
     async def start(self):
+        self.session = aiohttp.ClientSession(timeout=request_timeout)
         await self.update()
-        self.loop = self.update_loop()
+        self.loops = [
+            self._loop(self.update, self.update_every),
+            self._loop(self.update_statistics, self.statistics_every),
+        ]
 
-    def shutdown(self):
-        self.update_loop()
-        self.loop.cancel()
-        del self.loop
+    async def shutdown(self):
+        for loop in self.loops:
+            loop.cancel()
+        del self.loops
+        await self.session.close()
+        self.session = None
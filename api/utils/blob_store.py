@@ -0,0 +1,159 @@
+import asyncio
+import os
+import re
+import time
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+
+from cachetools import LRUCache
+
+REF_PREFIX = "sha256:"
+DIGEST_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+def text_ref(text):
+    return REF_PREFIX + sha256(text.encode()).hexdigest()
+
+
+class LocalBlobStore:
+    """
+    stores every blob as a file named by its digest in a directory, which can
+    be a volume that is shared with the plugins
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest):
+        if not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"invalid digest {digest}")
+        return self.path / digest[:2] / digest[2:]
+
+    def touch(self, digest):
+        """
+        sets the modification time of the blob to now, returns False if the
+        blob does not exist
+        """
+        try:
+            os.utime(self._path(digest))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def write(self, digest, data):
+        path = self._path(digest)
+        path.parent.mkdir(exist_ok=True)
+        # blobs are immutable, so concurrent writers of the same digest write
+        # the same content and the rename makes the file appear atomically
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{id(data)}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def read(self, digest):
+        return self._path(digest).read_bytes()
+
+    def delete_older_than(self, seconds):
+        """
+        deletes the blobs and leftover temporary files that were not modified
+        in the last `seconds`, returns how many were deleted
+        """
+        deadline = time.time() - seconds
+        deleted = 0
+        for path in self.path.glob("??/*"):
+            try:
+                if path.stat().st_mtime < deadline:
+                    path.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+
+BACKENDS = {
+    "local": LocalBlobStore,
+}
+
+
+def backend_from_uri(uri):
+    """
+    creates the backend from a uri like 'local:/blobs'
+    """
+    scheme, _, location = uri.partition(":")
+    try:
+        backend = BACKENDS[scheme]
+    except KeyError:
+        raise ValueError(
+            f"unknown blob store '{scheme}', available are {list(BACKENDS)}"
+        )
+    return backend(location)
+
+
+class BlobStore:
+    """
+    uploads texts once and replaces them by references of the form
+    'sha256:<hex digest>' that plugins with access to the same store resolve,
+    the digests that are known to be stored are remembered so that repeated
+    texts neither touch the backend nor are uploaded again
+
+    with `max_age` (seconds) blobs that were not stored or used in that time
+    are deleted by collect_garbage, a known digest is only trusted for half of
+    `max_age` and then its blob is touched again, so that a blob is never
+    deleted while it is referenced by a running request
+    """
+
+    def __init__(self, backend, known_size=100000, max_age=None):
+        self.backend = backend
+        # digest -> time when the blob was last stored or touched
+        self.known = LRUCache(known_size)
+        # _put runs in worker threads and cachetools caches are not thread-safe
+        self.lock = Lock()
+        self.max_age = max_age
+
+    def _put(self, texts):
+        now = time.time()
+        trusted_since = now - self.max_age / 2 if self.max_age else float("-inf")
+        refs = {}
+        for text in texts:
+            if text in refs:
+                continue
+            ref = text_ref(text)
+            refs[text] = ref
+            digest = ref[len(REF_PREFIX) :]
+            with self.lock:
+                stored = self.known.get(digest)
+            if stored is not None and stored >= trusted_since:
+                continue
+            if not self.backend.touch(digest):
+                self.backend.write(digest, text.encode())
+            with self.lock:
+                self.known[digest] = now
+        return refs
+
+    async def put(self, texts):
+        """
+        stores the texts and returns a dictionary that maps every text to its
+        reference
+        """
+        return await asyncio.to_thread(self._put, texts)
+
+    async def collect_garbage(self, interval):
+        """
+        deletes the blobs older than max_age every `interval` seconds
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.backend.delete_older_than, self.max_age)
+
+
+def blob_store_from_env():
+    uri = os.environ.get("BLOB_STORE")
+    if not uri:
+        return None
+    return BlobStore(
+        backend_from_uri(uri),
+        known_size=int(os.environ.get("BLOB_STORE_KNOWN_SIZE", 100000)),
+        # 0 keeps the blobs forever
+        max_age=float(os.environ.get("BLOB_STORE_MAX_AGE", 86400)) or None,
+    )
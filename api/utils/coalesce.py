@@ -0,0 +1,58 @@
+import asyncio
+import json
+from hashlib import sha256
+
+from cachetools import LRUCache
+
+
+def content_hash(*parts):
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return sha256(data.encode()).digest()
+
+
+class _Flight:
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    identical calls that are in flight at the same time share one future,
+    the future is cancelled when all callers are cancelled
+
+    results for which `cacheable(result)` is true are additionally kept in an
+    LRU cache under (version, key), so that a new version (e.g. a rebuilt
+    plugin) never gets the results of an old one
+    """
+
+    def __init__(self, cache_size=0, cacheable=lambda _: True):
+        self.flights = {}
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.cacheable = cacheable
+
+    def _finish(self, key, version, future):
+        del self.flights[key]
+        if self.cache is None or future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if self.cacheable(result):
+            self.cache[(version, key)] = result
+
+    async def run(self, key, version, coro_func):
+        if self.cache is not None and (version, key) in self.cache:
+            return self.cache[(version, key)]
+        flight = self.flights.get(key)
+        if flight is None:
+            future = asyncio.ensure_future(coro_func())
+            flight = self.flights[key] = _Flight(future)
+            future.add_done_callback(lambda future: self._finish(key, version, future))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                flight.future.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
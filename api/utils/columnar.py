@@ -0,0 +1,159 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _to_array(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowException, TypeError, ValueError):
+        return pa.array([json.dumps(value) for value in values])
+
+
+def column_name(model, key):
+    return f"{model}/{key}"
+
+
+def evaluation_table(models, num_examples, results):
+    """
+    builds the table directly from the flat plugin results where the scores
+    of all models are concatenated, every column is a zero copy slice
+    """
+    columns = {}
+    for metric, values in results.items():
+        array = _to_array(values)
+        for i, model in enumerate(models):
+            columns[column_name(model, metric)] = array.slice(
+                i * num_examples, num_examples
+            )
+    return pa.table(columns)
+
+
+def scores_table(scores):
+    return pa.table(
+        {
+            column_name(model, metric): _to_array(values)
+            for metric, model_scores in scores.items()
+            for model, values in model_scores.items()
+        }
+    )
+
+
+def summary_table(results, metadata=None):
+    columns = {key: _to_array(values) for key, values in results.items()}
+    if metadata is not None:
+        fields = list(dict.fromkeys(field for meta in metadata for field in meta))
+        for field in fields:
+            columns[f"metadata/{field}"] = _to_array(
+                [meta.get(field) for meta in metadata]
+            )
+    return pa.table(columns)
+
+
+def _with_metadata(table, metadata):
+    metadata = {key: json.dumps(value) for key, value in metadata.items() if value}
+    if not metadata:
+        return table
+    return table.replace_schema_metadata(metadata)
+
+
+def serialize(table, format, metadata={}):
+    """
+    serializes the table as an arrow ipc stream or a parquet file, json
+    values like errors are stored in the schema metadata
+    """
+    table = _with_metadata(table, metadata)
+    sink = pa.BufferOutputStream()
+    if format == "parquet":
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class _Buffer:
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+class TableStream:
+    """
+    incrementally writes record batches with a fixed schema as an arrow ipc
+    stream or as the row groups of a parquet file, `write` and `close` return
+    the bytes that are ready to be sent
+    """
+
+    def __init__(self, schema, format):
+        self.schema = schema
+        self.buffer = _Buffer()
+        if format == "parquet":
+            self.writer = pq.ParquetWriter(self.buffer, schema)
+        else:
+            self.writer = pa.ipc.new_stream(self.buffer, schema)
+
+    def write(self, rows):
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        return self.buffer.take()
+
+    def close(self):
+        self.writer.close()
+        return self.buffer.take()
+
+
+# one row per line, model and metric, because the models of a jsonl file are
+# only known after reading its lines
+STREAM_SCHEMA = pa.schema(
+    [
+        ("line", pa.int64()),
+        ("model", pa.string()),
+        ("metric", pa.string()),
+        ("score", pa.float64()),
+        ("error", pa.string()),
+    ]
+)
+
+
+def _score(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def stream_rows(entries):
+    rows = []
+    for entry in entries:
+        line = entry["line"]
+        if "error" in entry:
+            rows.append({"line": line, "error": entry["error"]})
+            continue
+        for metric, model_scores in entry["scores"].items():
+            for model, value in model_scores.items():
+                rows.append(
+                    {"line": line, "model": model, "metric": metric, "score": _score(value)}
+                )
+        for metric, messages in entry.get("errors", {}).items():
+            rows.append({"line": line, "metric": metric, "error": json.dumps(messages)})
+    return rows
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pyarrow.parquet as pq
+
+NON_MODEL_KEYS = {"document", "reference"}
+
+
+class LineError(Exception):
+    pass
+
+
+def _read_lines(file, num_lines):
+    lines = []
+    while len(lines) < num_lines:
+        line = file.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+    return lines
+
+
+def _is_parquet(file):
+    position = file.tell()
+    magic = file.read(4)
+    file.seek(position)
+    return magic == b"PAR1"
+
+
+def _parquet_lines(file, chunk_size):
+    for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+        yield [json.dumps(row, ensure_ascii=False) for row in batch.to_pylist()]
+
+
+async def iter_line_chunks(file, chunk_size):
+    """
+    yields the lines of a jsonl file in chunks, a parquet file (e.g. written
+    by jsonl_converter.py --parquet) is read in batches of rows that are
+    converted to json lines
+    """
+    if await asyncio.to_thread(_is_parquet, file):
+        chunks = _parquet_lines(file, chunk_size)
+        while lines := await asyncio.to_thread(next, chunks, None):
+            yield lines
+        return
+    while True:
+        lines = await asyncio.to_thread(_read_lines, file, chunk_size)
+        if not lines:
+            return
+        yield lines
+
+
+def parse_example(line):
+    try:
+        example = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise LineError(f"invalid json: {e}")
+    if not isinstance(example, dict):
+        raise LineError("the line is not a json object")
+    reference = example.get("reference")
+    if not isinstance(reference, str):
+        raise LineError("'reference' is missing or not a string")
+    hypotheses = {
+        key: value for key, value in example.items() if key not in NON_MODEL_KEYS
+    }
+    for key, value in hypotheses.items():
+        if not isinstance(value, str):
+            raise LineError(f"the hypothesis of '{key}' is not a string")
+    if not hypotheses:
+        raise LineError("the line contains no model")
+    return hypotheses, reference
+
+
+def dump_line(data):
+    return json.dumps(data, ensure_ascii=False) + "\n"
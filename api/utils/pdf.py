@@ -1,5 +1,10 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
 import aiohttp
 from bs4 import BeautifulSoup
+from cachetools import LRUCache
 from doc2json.grobid2json.tei_to_json import convert_tei_xml_soup_to_s2orc_json
 
 
@@ -43,12 +48,66 @@ def group_sections(pdf_json):
     return {"title": title, "abstract": abstract, "sections": sections}
 
 
+def sections_to_text(extracted):
+    sections = [("Abstract", [extracted["abstract"]])]
+    for section in extracted["sections"]:
+        heading = section["section"]
+        if section["secNum"] is not None:
+            heading = f"{section['secNum']} {heading}"
+        sections.append((heading, section["texts"]))
+    texts = [extracted["title"]] + [
+        "\n".join([heading, *texts]) for heading, texts in sections
+    ]
+    return "\n\n".join(text for text in texts if text)
+
+
+def tei_to_sections(xml):
+    soup = BeautifulSoup(xml, "xml")
+    pdf_json = convert_tei_xml_soup_to_s2orc_json(soup, "", "").release_json("pdf")
+    return group_sections(pdf_json)
+
+
 class Grobid:
-    def __init__(self, host):
-        self.host = host
+    """
+    client for one or more grobid servers
+
+    every server gets at most `concurrency` parallel requests and new requests
+    go to the server with the fewest active requests, results are cached by the
+    SHA-256 of the pdf and identical pdfs that are extracted concurrently share
+    one request, the TEI to json conversion runs in a process pool
+    """
+
+    def __init__(self, hosts, concurrency=4, cache_size=128, processes=1):
+        if isinstance(hosts, str):
+            hosts = [host.strip().rstrip("/") for host in hosts.split(",")]
+            hosts = [host for host in hosts if host]
+        if not hosts:
+            raise ValueError("at least one grobid host is required")
+        self.hosts = hosts
+        self.semaphores = {host: asyncio.Semaphore(concurrency) for host in hosts}
+        self.active = {host: 0 for host in hosts}
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.pending = {}
+        self.processes = processes
+        self.pool = None
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self.pool
+
+    def _pick_host(self):
+        return min(self.hosts, key=lambda host: self.active[host])
 
     async def _grobid(self, pdf_stream):
-        url = f"{self.host}/api/processFulltextDocument"
+        host = self._pick_host()
+        url = f"{host}/api/processFulltextDocument"
 
         data = aiohttp.FormData()
         data.add_field("input", pdf_stream, filename="", content_type="application/pdf")
@@ -60,18 +119,46 @@ class Grobid:
 
         headers = {"Accept": "application/xml"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=url, data=data, headers=headers) as response:
-                response.raise_for_status()
-                return await response.text()
+        self.active[host] += 1
+        try:
+            async with self.semaphores[host]:
+                session = self._get_session()
+                async with session.post(url=url, data=data, headers=headers) as response:
+                    response.raise_for_status()
+                    return await response.text()
+        finally:
+            self.active[host] -= 1
 
-    async def extract_pdf(self, pdf_stream):
+    async def _extract_pdf(self, pdf_stream):
         try:
             xml = await self._grobid(pdf_stream)
         except aiohttp.ClientResponseError as e:
             raise GrobidError(f"Grobid failed with status code {e.status}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), tei_to_sections, xml)
+
+    async def extract_pdf(self, pdf_stream):
+        key = sha256(pdf_stream).digest()
+        if self.cache is not None and key in self.cache:
+            return self.cache[key]
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._extract_pdf(pdf_stream))
+            self.pending[key] = future
+            future.add_done_callback(lambda future: self._finish(key, future))
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        del self.pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        if self.cache is not None:
+            self.cache[key] = future.result()
 
-        soup = BeautifulSoup(xml, "xml")
-        pdf_json = convert_tei_xml_soup_to_s2orc_json(soup, "", "").release_json("pdf")
-        sections = group_sections(pdf_json)
-        return sections
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
@@ -1,29 +1,59 @@
+import numpy as np
 import spacy
 from model_setup import SPACY_MODEL
 from utils.aio import to_threaded
 
+# only the parser (and the tok2vec it listens to) is needed for the sentence
+# boundaries, the vectors come from the static vector table
+DISABLED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+
+def _normalized_vectors(sentences, width):
+    if not sentences:
+        return np.zeros((0, width), dtype=np.float32)
+    vectors = np.stack([sentence.vector for sentence in sentences])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+
 
 class SemanticSimilarity:
     def __init__(self):
-        self.nlp = spacy.load(SPACY_MODEL)
-
-    def _get_sentences(self, text):
-        if isinstance(text, str):
-            text = [s for s in self.nlp(text).sents if any(t.is_alpha for t in s)]
-        else:
-            text = [self.nlp(s) for s in text]
-        return text
-
-    def evaluate(self, document, summary):
-        document_sents = self._get_sentences(document)
-        summary_sents = self._get_sentences(summary)
+        self.nlp = spacy.load(SPACY_MODEL, disable=DISABLED_COMPONENTS)
+        self.width = self.nlp.vocab.vectors_length
+
+    def _get_sentences(self, texts):
+        parsed = self.nlp.pipe([text for text in texts if isinstance(text, str)])
+        tokenized = self.nlp.tokenizer.pipe(
+            [sent for text in texts if not isinstance(text, str) for sent in text]
+        )
+        sentences = []
+        for text in texts:
+            if isinstance(text, str):
+                doc = next(parsed)
+                sentences.append([s for s in doc.sents if any(t.is_alpha for t in s)])
+            else:
+                sentences.append([next(tokenized) for _ in text])
+        return sentences
+
+    def evaluate(self, document, summaries):
+        document_sents, *summaries_sents = self._get_sentences([document, *summaries])
+        all_summary_sents = [sent for sents in summaries_sents for sent in sents]
+        document_vectors = _normalized_vectors(document_sents, self.width)
+        summary_vectors = _normalized_vectors(all_summary_sents, self.width)
+        scores = summary_vectors @ document_vectors.T
+        offsets = np.cumsum([len(sents) for sents in summaries_sents])[:-1]
+        results = [
+            {
+                "summarySentences": [s.text_with_ws for s in summary_sents],
+                "scores": summary_scores.tolist(),
+            }
+            for summary_sents, summary_scores in zip(
+                summaries_sents, np.split(scores, offsets)
+            )
+        ]
         return {
-            "documentSentences": [doc_sent.text_with_ws for doc_sent in document_sents],
-            "summarySentences": [sum_sent.text_with_ws for sum_sent in summary_sents],
-            "scores": [
-                [doc_sent.similarity(sum_sent) for doc_sent in document_sents]
-                for sum_sent in summary_sents
-            ],
+            "documentSentences": [s.text_with_ws for s in document_sents],
+            "summaries": results,
         }
 
 
@@ -32,4 +62,11 @@ evaluator = SemanticSimilarity()
 
 @to_threaded
 def semantic_similarity(sentences, summary):
-    return evaluator.evaluate(sentences, summary)
+    result = evaluator.evaluate(sentences, [summary])
+    (summary_result,) = result.pop("summaries")
+    return {**result, **summary_result}
+
+
+@to_threaded
+def semantic_similarity_multiple(sentences, summaries):
+    return evaluator.evaluate(sentences, summaries)
@@ -1,7 +1,89 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+
 import nltk
-from utils.aio import to_threaded
+from cachetools import LRUCache
+
+SENTENCE_CACHE_SIZE = int(os.environ.get("SENTENCE_CACHE_SIZE", 10000))
+SENTENCE_PROCESSES = int(os.environ.get("SENTENCE_PROCESSES", os.cpu_count() or 1))
+SENTENCE_PROCESS_THRESHOLD = int(
+    os.environ.get("SENTENCE_PROCESS_THRESHOLD", 2_000_000)
+)
+
+
+def split_all(texts):
+    return [nltk.sent_tokenize(text) for text in texts]
+
+
+def text_hash(text):
+    return sha256(text.encode()).digest()
+
+
+class SentenceSplitter:
+    """
+    splits many texts with a single executor call and caches the splits by the
+    hash of the text, texts with more than `process_threshold` characters in
+    total are split in a process pool instead of a thread
+    """
+
+    def __init__(self, cache_size=0, processes=1, process_threshold=2_000_000):
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.processes = processes
+        self.process_threshold = process_threshold
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self.pool
+
+    async def _split(self, texts):
+        loop = asyncio.get_running_loop()
+        size = sum(len(text) for text in texts)
+        if self.processes <= 1 or size < self.process_threshold:
+            return await asyncio.to_thread(split_all, texts)
+        chunk_size = -(-len(texts) // self.processes)
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        pool = self._get_pool()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(pool, split_all, chunk) for chunk in chunks]
+        )
+        return [sentences for result in results for sentences in result]
+
+    async def split(self, texts):
+        keys = [text_hash(text) for text in texts]
+        found = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            if self.cache is not None and key in self.cache:
+                found[key] = self.cache[key]
+            else:
+                missing[key] = text
+        if missing:
+            missing_keys, missing_texts = zip(*missing.items())
+            splits = await self._split(list(missing_texts))
+            for key, sentences in zip(missing_keys, splits):
+                found[key] = sentences
+                if self.cache is not None:
+                    self.cache[key] = sentences
+        return [found[key] for key in keys]
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+splitter = SentenceSplitter(
+    cache_size=SENTENCE_CACHE_SIZE,
+    processes=SENTENCE_PROCESSES,
+    process_threshold=SENTENCE_PROCESS_THRESHOLD,
+)
 
 
-@to_threaded
-def sentence_split(text):
-    return nltk.sent_tokenize(text)
+async def sentence_split_batch(texts):
+    return await splitter.split(texts)
@@ -0,0 +1,208 @@
+import warnings
+from itertools import combinations
+
+import numpy as np
+
+# number of (resample x example) cells that are materialized at once
+BLOCK_CELLS = 4_000_000
+
+
+def _score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _as_series(values):
+    """
+    returns the scores as a float array where scores that are not numbers are
+    NaN, None if `values` is not a list of scores
+    """
+    try:
+        series = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        if not isinstance(values, (list, tuple)):
+            return None
+        series = np.array([_score(value) for value in values], dtype=np.float64)
+    if series.ndim != 1:
+        return None
+    return series
+
+
+def _resample_counts(rng, num_examples, num_resamples):
+    """
+    yields blocks of bootstrap resamples as count matrices where entry (i, j)
+    is how often example j is drawn in resample i, so that the means of all
+    series under a block of resamples are a single matrix product
+    """
+    block_size = max(1, BLOCK_CELLS // max(num_examples, 1))
+    for start in range(0, num_resamples, block_size):
+        size = min(block_size, num_resamples - start)
+        # a block has at most BLOCK_CELLS cells, so int32 offsets suffice
+        shape = (size, num_examples)
+        indices = rng.integers(0, num_examples, size=shape, dtype=np.int32)
+        offsets = np.arange(0, size * num_examples, num_examples, dtype=np.int32)
+        indices += offsets[:, None]
+        counts = np.bincount(indices.ravel(), minlength=size * num_examples)
+        yield counts.reshape(size, num_examples).astype(np.float64)
+
+
+def _sign_flips(rng, num_examples, num_permutations):
+    block_size = max(1, BLOCK_CELLS // max(num_examples, 1))
+    for start in range(0, num_permutations, block_size):
+        size = min(block_size, num_permutations - start)
+        # eight signs per random byte
+        random_bytes = rng.integers(
+            0, 256, size=(size, -(-num_examples // 8)), dtype=np.uint8
+        )
+        bits = np.unpackbits(random_bytes, axis=1, count=num_examples)
+        yield bits.astype(np.float64) * 2 - 1
+
+
+def _masked_means(weights, values, mask):
+    sums = weights @ values.T
+    counts = weights @ mask.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _interval(samples, confidence):
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lower, upper = np.nanquantile(samples, [alpha, 1 - alpha], axis=0)
+    return lower, upper
+
+
+def _float(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def aggregate_scores(
+    scores, resamples=1000, permutations=1000, confidence=0.95, seed=None
+):
+    """
+    computes mean, median, standard deviation and a bootstrap confidence
+    interval for every metric and model of `scores` ({metric: {model: [score]}})
+    and compares every pair of models of a metric with a paired bootstrap and a
+    paired sign-flip permutation test
+
+    all series are resampled with the same resamples, scores that are missing
+    or not numbers are ignored and comparisons only use the examples where
+    both models have a score
+    """
+    rng = np.random.default_rng(seed)
+    names = []
+    series = []
+    for metric, model_scores in scores.items():
+        for model, values in model_scores.items():
+            values = _as_series(values)
+            if values is not None:
+                names.append((metric, model))
+                series.append(values)
+    aggregates = {}
+    comparisons = {}
+    if not series:
+        return {"aggregates": aggregates, "comparisons": comparisons}
+    num_examples = max(len(values) for values in series)
+    values = np.full((len(series), num_examples), np.nan)
+    for i, s in enumerate(series):
+        values[i, : len(s)] = s
+    mask = ~np.isnan(values)
+
+    index = {name: i for i, name in enumerate(names)}
+    pairs = []
+    for metric, model_scores in scores.items():
+        models = [model for model in model_scores if (metric, model) in index]
+        for first, second in combinations(models, 2):
+            pairs.append((metric, first, second))
+    differences = np.array(
+        [
+            values[index[(metric, first)]] - values[index[(metric, second)]]
+            for metric, first, second in pairs
+        ]
+    ).reshape(len(pairs), num_examples)
+    pair_mask = ~np.isnan(differences)
+
+    # the series and the pairwise differences share the resamples
+    raw_values = np.concatenate([values, differences])
+    all_values = np.nan_to_num(raw_values)
+    all_mask = np.concatenate([mask, pair_mask]).astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        observed = np.nanmean(raw_values, axis=1)
+        medians = np.nanmedian(values, axis=1)
+        stds = np.nanstd(values, axis=1)
+    # the resamples and sign flips of empty series have no examples to draw
+    if resamples > 0 and num_examples:
+        boot = np.concatenate(
+            [
+                _masked_means(weights, all_values, all_mask)
+                for weights in _resample_counts(rng, num_examples, resamples)
+            ]
+        )
+        lower, upper = _interval(boot, confidence)
+    else:
+        boot = None
+        lower = upper = np.full(len(all_values), np.nan)
+
+    counts = mask.sum(axis=1)
+    for i, (metric, model) in enumerate(names):
+        aggregates.setdefault(metric, {})[model] = {
+            "n": int(counts[i]),
+            "mean": _float(observed[i]),
+            "median": _float(medians[i]),
+            "std": _float(stds[i]),
+            "ci": [_float(lower[i]), _float(upper[i])],
+        }
+
+    if not pairs:
+        return {"aggregates": aggregates, "comparisons": comparisons}
+    offset = len(names)
+    pair_observed = observed[offset:]
+    pair_values = all_values[offset:]
+    pair_counts = pair_mask.sum(axis=1)
+    if boot is not None:
+        pair_boot = boot[:, offset:]
+        valid = ~np.isnan(pair_boot)
+        below = ((pair_boot <= 0) & valid).sum(axis=0)
+        above = ((pair_boot >= 0) & valid).sum(axis=0)
+        total = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bootstrap_p = np.minimum(1.0, 2 * np.minimum(below, above) / total)
+    else:
+        bootstrap_p = np.full(len(pairs), np.nan)
+    if permutations > 0 and num_examples:
+        # under the null hypothesis the sign of every paired difference is
+        # arbitrary, zeros of missing pairs do not contribute to the sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            permuted = np.concatenate(
+                [
+                    (signs @ pair_values.T) / pair_counts
+                    for signs in _sign_flips(rng, num_examples, permutations)
+                ]
+            )
+        # the permuted means are summed in another order than the observed
+        # ones, the rounding error grows with the magnitude of the differences
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scale = np.abs(pair_values).sum(axis=1) / pair_counts
+        tolerance = 1e-9 * np.maximum(1.0, np.nan_to_num(scale))
+        extreme = (np.abs(permuted) >= np.abs(pair_observed) - tolerance).sum(axis=0)
+        permutation_p = (extreme + 1) / (permutations + 1)
+    else:
+        permutation_p = np.full(len(pairs), np.nan)
+    for i, (metric, first, second) in enumerate(pairs):
+        j = offset + i
+        comparisons.setdefault(metric, []).append(
+            {
+                "models": [first, second],
+                "n": int(pair_counts[i]),
+                "difference": _float(pair_observed[i]),
+                "ci": [_float(lower[j]), _float(upper[j])],
+                "bootstrap_p": _float(bootstrap_p[i]) if pair_counts[i] else None,
+                "permutation_p": _float(permutation_p[i]) if pair_counts[i] else None,
+            }
+        )
+    return {"aggregates": aggregates, "comparisons": comparisons}
@@ -9,6 +9,8 @@ PLUGIN_DOCKERFILE_PATH = Path("./docker/Dockerfile.plugin")
 CONTAINER_PLUGIN_FILES_PATH = Path("/summary_workbench_plugin_files")
 CONTAINER_PLUGIN_SERVER_PATH = Path("/summary_workbench_plugin_server")
 DEV_BOOT_PATH = CONTAINER_PLUGIN_SERVER_PATH / "dev.boot.sh"
+BLOB_STORE_VOLUME = "blob_store"
+CONTAINER_BLOB_STORE_PATH = Path("/blobs")
 PLUGIN_SERVER_PATH = Path("./plugin_server").absolute()
 REMOTE_PLUGIN_FOLDER = Path("~/.summary_workbench_plugins").expanduser()
 REQUIRED_FILE_GROUPS = [{"Pipfile.lock", "Pipfile", "requirements.txt"}]
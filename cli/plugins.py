@@ -4,7 +4,8 @@ import uuid
 from collections import defaultdict
 from itertools import chain
 
-from .config import (CONTAINER_PLUGIN_FILES_PATH, CONTAINER_PLUGIN_SERVER_PATH,
+from .config import (BLOB_STORE_VOLUME, CONTAINER_BLOB_STORE_PATH,
+                     CONTAINER_PLUGIN_FILES_PATH, CONTAINER_PLUGIN_SERVER_PATH,
                      DEFAULT_PLUGIN_CONFIG, DEPLOY_PATH, DEV_BOOT_PATH,
                      KUBERNETES_TEMPLATES_PATH, PLUGIN_DOCKERFILE_PATH,
                      PLUGIN_SERVER_PATH, REQUIRED_FILE_GROUPS,
@@ -130,7 +131,7 @@ class Plugin(DockerMixin):
 
         self.dev_environment = [
             f"{key}={value}" for key, value in self.all_environment.items()
-        ]
+        ] + [f"BLOB_STORE=local:{CONTAINER_BLOB_STORE_PATH}"]
         self.kubernetes_environment = [
             {"name": key, "value": value}
             for key, value in self.extern_environment.items()
@@ -150,10 +151,11 @@ class Plugin(DockerMixin):
             str(PLUGIN_SERVER_PATH): str(CONTAINER_PLUGIN_SERVER_PATH),
             str(self.plugin_path): str(CONTAINER_PLUGIN_FILES_PATH),
         }
-        self.volumes = {**self.named_volumes, **self.path_volumes}
-        self.path_volumes = {
-            str(PLUGIN_SERVER_PATH): str(CONTAINER_PLUGIN_SERVER_PATH),
-            str(self.plugin_path): str(CONTAINER_PLUGIN_FILES_PATH),
+        # the blob store volume is declared by the api service
+        self.volumes = {
+            **self.named_volumes,
+            **self.path_volumes,
+            BLOB_STORE_VOLUME: str(CONTAINER_BLOB_STORE_PATH),
         }
         DockerMixin.__init__(
             self,
@@ -4,19 +4,111 @@ convert files where every line corresponds to one document/reference/model to js
 first argument: document file
 second argument: reference file
 all following arguments: model files
+
+the files are read line by line in lockstep, so the memory usage does not
+depend on the size of the files
 """
 
+import argparse
 import json
-from pathlib import Path
-from sys import argv
-
-files = argv[1:]
-if len(files) < 2:
-    print("provide at least a document and reference file")
-    exit(1)
-
-args = [Path(file).read_text().splitlines() for file in files]
-keys = ["document", "reference"] + [f"model{i+1}" for i in range(len(argv) - 2)]
-lines = [dict(zip(keys, e)) for e in zip(*args)]
-for line in lines:
-    print(json.dumps(line, ensure_ascii=False))
+import sys
+from contextlib import ExitStack
+from itertools import islice
+from multiprocessing import Pool
+
+BATCH_SIZE = 1000
+
+
+def model_keys(num_files):
+    return ["document", "reference"] + [f"model{i+1}" for i in range(num_files - 2)]
+
+
+def read_lockstep(files):
+    for lines in zip(*files):
+        yield [line.rstrip("\r\n") for line in lines]
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def encode_batch(args):
+    keys, batch = args
+    return "".join(
+        json.dumps(dict(zip(keys, lines)), ensure_ascii=False) + "\n"
+        for lines in batch
+    )
+
+
+def write_jsonl(rows, keys, out, processes):
+    tasks = ((keys, batch) for batch in batches(rows, BATCH_SIZE))
+    if processes > 1:
+        with Pool(processes) as pool:
+            for text in pool.imap(encode_batch, tasks):
+                out.write(text)
+    else:
+        for text in map(encode_batch, tasks):
+            out.write(text)
+
+
+def write_parquet(rows, keys, path, row_group_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("writing parquet files requires pyarrow (pip install pyarrow)")
+    schema = pa.schema([(key, pa.string()) for key in keys])
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches(rows, row_group_size):
+            columns = [pa.array(column, pa.string()) for column in zip(*batch)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("document_file")
+    parser.add_argument("reference_file")
+    parser.add_argument("model_files", nargs="*")
+    parser.add_argument(
+        "-o", "--output", help="write the jsonl to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="FILE",
+        help="write a parquet file with one column per document/reference/model instead of jsonl",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=10000,
+        help="number of lines per row group of the parquet file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes that encode the jsonl lines (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    paths = [args.document_file, args.reference_file, *args.model_files]
+    keys = model_keys(len(paths))
+    with ExitStack() as stack:
+        files = [stack.enter_context(open(path, encoding="utf-8")) for path in paths]
+        rows = read_lockstep(files)
+        if args.parquet:
+            write_parquet(rows, keys, args.parquet, args.row_group_size)
+            return
+        if args.output:
+            out = stack.enter_context(
+                open(args.output, "w", encoding="utf-8", buffering=1 << 20)
+            )
+        else:
+            out = sys.stdout
+        write_jsonl(rows, keys, out, args.processes)
+
+
+if __name__ == "__main__":
+    main()
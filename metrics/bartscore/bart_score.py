@@ -1,10 +1,15 @@
 # %%
+from collections import Counter
 from typing import List
 
 import numpy as np
 import torch
-import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
 from transformers import BartForConditionalGeneration, BartTokenizer
+from transformers.models.bart.modeling_bart import shift_tokens_right
+
+# number of target tokens whose logits are computed at once
+LOGITS_CHUNK_SIZE = 512
 
 
 class BARTScorer:
@@ -19,73 +24,183 @@ class BARTScorer:
         self.model.eval()
         self.model.to(device)
 
-        # Set up loss
-        self.loss_fct = nn.NLLLoss(
-            reduction="none", ignore_index=self.model.config.pad_token_id
-        )
-        self.lsm = nn.LogSoftmax(dim=1)
-
     def load(self, path=None):
         """Load model from paraphrase finetuning"""
         if path is None:
             path = "models/bart.pth"
         self.model.load_state_dict(torch.load(path, map_location=self.device))
 
-    def score(self, srcs, tgts, batch_size=4):
-        """Score a batch of examples"""
-        score_list = []
-        for i in range(0, len(srcs), batch_size):
-            src_list = srcs[i : i + batch_size]
-            tgt_list = tgts[i : i + batch_size]
-            with torch.no_grad():
-                encoded_src = self.tokenizer(
-                    src_list,
-                    max_length=self.max_length,
-                    truncation=True,
-                    padding=True,
-                    return_tensors="pt",
-                )
-                encoded_tgt = self.tokenizer(
-                    tgt_list,
-                    max_length=self.max_length,
-                    truncation=True,
-                    padding=True,
-                    return_tensors="pt",
-                )
-                src_tokens = encoded_src["input_ids"].to(self.device)
-                src_mask = encoded_src["attention_mask"].to(self.device)
+    def _batches(self, src_lengths, tgt_lengths, src_groups, batch_size, max_tokens):
+        """
+        groups the examples sorted by source length into batches of at most
+        batch_size examples whose padded source and target tokens stay within
+        max_tokens, an example that exceeds max_tokens forms its own batch,
+        examples with the same source group are adjacent
+        """
+        order = sorted(
+            range(len(src_lengths)),
+            key=lambda i: (src_lengths[i], src_groups[i], tgt_lengths[i]),
+            reverse=True,
+        )
+        batch = []
+        max_src = max_tgt = 0
+        for i in order:
+            new_src = max(max_src, src_lengths[i])
+            new_tgt = max(max_tgt, tgt_lengths[i])
+            if batch and (
+                len(batch) == batch_size
+                or max_tokens is not None
+                and (len(batch) + 1) * (new_src + new_tgt) > max_tokens
+            ):
+                yield batch
+                batch = []
+                new_src, new_tgt = src_lengths[i], tgt_lengths[i]
+            batch.append(i)
+            max_src, max_tgt = new_src, new_tgt
+        if batch:
+            yield batch
 
-                tgt_tokens = encoded_tgt["input_ids"].to(self.device)
-                tgt_mask = encoded_tgt["attention_mask"]
-                tgt_len = tgt_mask.sum(dim=1).to(self.device)
+    def _pad(self, input_ids):
+        encoded = self.tokenizer.pad({"input_ids": input_ids}, return_tensors="pt")
+        tokens = encoded["input_ids"].to(self.device)
+        mask = encoded["attention_mask"].to(self.device)
+        return tokens, mask
 
-                output = self.model(
-                    input_ids=src_tokens, attention_mask=src_mask, labels=tgt_tokens
-                )
-                logits = output.logits.view(-1, self.model.config.vocab_size)
-                loss = self.loss_fct(self.lsm(logits), tgt_tokens.view(-1))
-                loss = loss.view(tgt_tokens.shape[0], -1)
-                loss = loss.sum(dim=1) / tgt_len
-                curr_score_list = [-x.item() for x in loss]
-                score_list += curr_score_list
-        return score_list
+    def _encode(self, src_ids):
+        """
+        runs the encoder and returns the unpadded outputs of every source
+        """
+        src_tokens, src_mask = self._pad(src_ids)
+        states = self.model.model.encoder(
+            input_ids=src_tokens, attention_mask=src_mask
+        ).last_hidden_state
+        # copies, so that the padded batch is not kept alive
+        return [states[i, : len(ids)].clone() for i, ids in enumerate(src_ids)]
+
+    def _pad_states(self, states):
+        lengths = torch.tensor([len(s) for s in states], device=self.device)
+        padded = pad_sequence(states, batch_first=True)
+        mask = torch.arange(padded.size(1), device=self.device)[None, :]
+        return padded, (mask < lengths[:, None]).long()
+
+    def _nll(self, states, src_mask, tgt_tokens):
+        """
+        mean negative log likelihood of every target given the encoder
+        outputs, the logits are only computed for the target tokens and in
+        chunks, so that the full (batch x length x vocabulary) logits are never
+        materialized
+        """
+        config = self.model.config
+        decoder_input_ids = shift_tokens_right(
+            tgt_tokens, config.pad_token_id, config.decoder_start_token_id
+        )
+        hidden = self.model.model.decoder(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=states,
+            encoder_attention_mask=src_mask,
+        ).last_hidden_state
+        tgt_mask = tgt_tokens != config.pad_token_id
+        hidden = hidden[tgt_mask]
+        targets = tgt_tokens[tgt_mask]
+        nll = torch.empty(len(targets), device=hidden.device)
+        for start in range(0, len(targets), LOGITS_CHUNK_SIZE):
+            end = start + LOGITS_CHUNK_SIZE
+            logits = self.model.lm_head(hidden[start:end])
+            logits += self.model.final_logits_bias.to(logits.device)
+            nll[start:end] = torch.logsumexp(logits, dim=-1) - logits.gather(
+                1, targets[start:end, None]
+            ).squeeze(1)
+            del logits
+        rows = tgt_mask.nonzero()[:, 0]
+        sums = torch.zeros(len(tgt_tokens), device=nll.device)
+        sums.index_add_(0, rows, nll)
+        return sums / tgt_mask.sum(dim=1)
 
-    def multi_ref_score(self, srcs, tgts: List[List[str]], agg="mean", batch_size=4):
-        # Assert we have the same number of references
-        ref_nums = [len(x) for x in tgts]
-        if len(set(ref_nums)) > 1:
-            raise Exception("You have different number of references per test sample.")
+    def score(self, srcs, tgts, batch_size=4, max_tokens=None):
+        """
+        Score a batch of examples
 
-        ref_num = len(tgts[0])
-        score_matrix = []
-        for i in range(ref_num):
-            curr_tgts = [x[i] for x in tgts]
-            scores = self.score(srcs, curr_tgts, batch_size)
-            score_matrix.append(scores)
+        the encoder runs once per unique source and its outputs are reused for
+        all targets of that source, they are freed after the last target
+        """
+        unique_srcs = {}
+        src_groups = [unique_srcs.setdefault(src, len(unique_srcs)) for src in srcs]
+        src_ids = self.tokenizer(
+            list(unique_srcs), max_length=self.max_length, truncation=True
+        )["input_ids"]
+        tgt_ids = self.tokenizer(
+            list(tgts), max_length=self.max_length, truncation=True
+        )["input_ids"]
+        remaining = Counter(src_groups)
+        encoded = {}
+        score_list = [None] * len(srcs)
+        batches = self._batches(
+            [len(src_ids[group]) for group in src_groups],
+            [len(ids) for ids in tgt_ids],
+            src_groups,
+            batch_size,
+            max_tokens,
+        )
+        for indices in batches:
+            groups = [src_groups[i] for i in indices]
+            with torch.no_grad():
+                new_groups = [g for g in dict.fromkeys(groups) if g not in encoded]
+                if new_groups:
+                    states = self._encode([src_ids[g] for g in new_groups])
+                    encoded.update(zip(new_groups, states))
+                states, src_mask = self._pad_states([encoded[g] for g in groups])
+                tgt_tokens, _ = self._pad([tgt_ids[i] for i in indices])
+                loss = self._nll(states, src_mask, tgt_tokens)
+            for i, value in zip(indices, loss.tolist()):
+                score_list[i] = -value
+            for group in groups:
+                remaining[group] -= 1
+                if not remaining[group]:
+                    del encoded[group]
+        return score_list
+
+    def multi_ref_score(
+        self,
+        srcs,
+        tgts: List[List[str]],
+        agg="mean",
+        batch_size=4,
+        max_tokens=None,
+        direction="forward",
+    ):
+        """
+        scores every source against its references and aggregates the scores,
+        the direction 'forward' scores the references given the source,
+        'backward' the source given the references and 'both' takes the mean
+        of the two directions, which are scored in one pass so that every text
+        is encoded once
+        """
         if agg == "mean":
-            score_list = np.mean(score_matrix, axis=0)
+            aggregate = np.mean
         elif agg == "max":
-            score_list = np.max(score_matrix, axis=0)
+            aggregate = np.max
         else:
             raise NotImplementedError
-        return list(score_list)
+        flat_srcs = [src for src, refs in zip(srcs, tgts) for _ in refs]
+        flat_tgts = [ref for refs in tgts for ref in refs]
+        if direction == "forward":
+            scores = self.score(flat_srcs, flat_tgts, batch_size, max_tokens)
+        elif direction == "backward":
+            scores = self.score(flat_tgts, flat_srcs, batch_size, max_tokens)
+        elif direction == "both":
+            scores = self.score(
+                flat_srcs + flat_tgts, flat_tgts + flat_srcs, batch_size, max_tokens
+            )
+            num_pairs = len(flat_srcs)
+            scores = [
+                (forward + backward) / 2
+                for forward, backward in zip(scores[:num_pairs], scores[num_pairs:])
+            ]
+        else:
+            raise NotImplementedError
+        score_list = []
+        start = 0
+        for refs in tgts:
+            score_list.append(float(aggregate(scores[start : start + len(refs)])))
+            start += len(refs)
+        return score_list
@@ -1,12 +1,46 @@
+import os
+from typing import Literal
+
 from bart_score import BARTScorer
 
 DEVICE = "cpu"
+# upper bound for the padded source and target tokens of one forward pass
+BATCH_TOKENS = int(os.environ.get("BATCH_TOKENS", 8192))
+
+# BARTScore variant -> direction of BARTScorer.multi_ref_score with the
+# hypothesis as source
+DIRECTIONS = {"recall": "forward", "precision": "backward", "f": "both"}
 
 
 class MetricPlugin:
     def __init__(self):
         self.bart = BARTScorer(device=DEVICE, checkpoint="facebook/bart-large-cnn")
 
-    def evaluate(self, batch):
+    def evaluate(
+        self,
+        batch,
+        variant: Literal["recall", "precision", "f"] = "recall",
+        reference_separator: str = "",
+        aggregation: Literal["mean", "max"] = "mean",
+    ):
         hypotheses, references = zip(*batch)
-        return self.bart.score(hypotheses, references, batch_size=len(batch))
+        if reference_separator:
+            references = [
+                [
+                    part.strip()
+                    for part in reference.split(reference_separator)
+                    if part.strip()
+                ]
+                or [reference]
+                for reference in references
+            ]
+        else:
+            references = [[reference] for reference in references]
+        return self.bart.multi_ref_score(
+            hypotheses,
+            references,
+            agg=aggregation,
+            batch_size=None,
+            max_tokens=BATCH_TOKENS,
+            direction=DIRECTIONS[variant],
+        )
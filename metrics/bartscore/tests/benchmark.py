@@ -0,0 +1,139 @@
+"""
+time and peak memory of BARTScorer.score with a token budget and of the
+scoring loop it replaced (fixed size batches and the full logits), every
+mode runs in its own process, run from metrics/bartscore:
+python -m tests.benchmark [--pairs N] [--checkpoint PATH]
+"""
+
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from bart_score import BARTScorer
+
+WORDS = "the cat sat on a mat while dogs barked loudly into the night".split()
+
+
+def reference_score(scorer, srcs, tgts, batch_size):
+    """
+    the previous BARTScorer.score, the logits of a whole batch are computed
+    and normalized at once
+    """
+    loss_fct = nn.NLLLoss(
+        reduction="none", ignore_index=scorer.model.config.pad_token_id
+    )
+    lsm = nn.LogSoftmax(dim=1)
+    score_list = []
+    for i in range(0, len(srcs), batch_size):
+        with torch.no_grad():
+            encoded_src = scorer.tokenizer(
+                srcs[i : i + batch_size],
+                max_length=scorer.max_length,
+                truncation=True,
+                padding=True,
+                return_tensors="pt",
+            )
+            encoded_tgt = scorer.tokenizer(
+                tgts[i : i + batch_size],
+                max_length=scorer.max_length,
+                truncation=True,
+                padding=True,
+                return_tensors="pt",
+            )
+            tgt_tokens = encoded_tgt["input_ids"]
+            tgt_len = encoded_tgt["attention_mask"].sum(dim=1)
+            output = scorer.model(
+                input_ids=encoded_src["input_ids"],
+                attention_mask=encoded_src["attention_mask"],
+                labels=tgt_tokens,
+            )
+            logits = output.logits.view(-1, scorer.model.config.vocab_size)
+            loss = loss_fct(lsm(logits), tgt_tokens.view(-1))
+            loss = loss.view(tgt_tokens.shape[0], -1).sum(dim=1) / tgt_len
+            score_list += [-x.item() for x in loss]
+    return score_list
+
+
+def text(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def pairs(count):
+    rng = random.Random(0)
+    srcs = [text(rng, rng.randint(1, 40)) for _ in range(count)]
+    tgts = [text(rng, rng.randint(1, 30)) for _ in range(count)]
+    # a long hypothesis pads the batch it is part of
+    srcs[min(3, count - 1)] = text(rng, 600)
+    return srcs, tgts
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(args):
+    scorer = BARTScorer(device="cpu", checkpoint=args.checkpoint)
+    srcs, tgts = pairs(args.pairs)
+    loaded = peak_rss_mb()
+    start = time.perf_counter()
+    if args.mode == "reference":
+        scores = reference_score(scorer, srcs, tgts, args.batch_size)
+    else:
+        scores = scorer.score(srcs, tgts, batch_size=None, max_tokens=args.max_tokens)
+    seconds = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "loaded_mb": loaded,
+                "peak_mb": peak_rss_mb(),
+                "scores": scores,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pairs", type=int, default=64)
+    parser.add_argument("--checkpoint", default="facebook/bart-large-cnn")
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="batch size of the reference"
+    )
+    parser.add_argument("--max-tokens", type=int, default=8192)
+    parser.add_argument("--mode", choices=["reference", "budget"])
+    args = parser.parse_args()
+    if args.mode:
+        run_mode(args)
+        return
+
+    results = {}
+    for mode in ["reference", "budget"]:
+        output = subprocess.run(
+            [sys.executable, "-m", "tests.benchmark", *sys.argv[1:], "--mode", mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output.splitlines()[-1])
+    difference = np.abs(
+        np.array(results["reference"]["scores"]) - np.array(results["budget"]["scores"])
+    ).max()
+    print(f"{args.pairs} pairs, max score difference {difference:.1e}")
+    for mode, result in results.items():
+        print(
+            f"{mode:10} {result['seconds']:8.2f}s  peak {result['peak_mb']:8.0f} MB"
+            f"  ({result['peak_mb'] - result['loaded_mb']:.0f} MB above the loaded model)"
+        )
+
+
+if __name__ == "__main__":
+    main()
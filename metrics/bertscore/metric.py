@@ -1,17 +1,108 @@
 import os
+from collections import defaultdict
+from hashlib import sha256
+from threading import Lock
 
+import torch
 from bert_score import BERTScorer
+from bert_score.utils import get_bert_embedding, greedy_cos_idf
+from cachetools import LRUCache
+from torch.nn.utils.rnn import pad_sequence
 
 MODEL = os.environ.get("model") or "microsoft/deberta-xlarge-mnli"
+BATCH_SIZE = 64
+# the embedding cache is bounded by the size of the cached tensors, 256 MB
+# are about 64000 tokens of deberta-xlarge
+CACHE_BYTES = int(float(os.environ.get("EMBEDDING_CACHE_MB", 256)) * 2**20)
+
+
+def _num_bytes(stats):
+    return sum(tensor.element_size() * tensor.nelement() for tensor in stats)
 
 
 class MetricPlugin:
     def __init__(self):
         self.bert = BERTScorer(model_type=MODEL, rescale_with_baseline=True, lang="en")
+        tokenizer = self.bert._tokenizer
+        # the weights that BERTScorer.score uses without idf
+        self.idf_dict = defaultdict(lambda: 1.0)
+        self.idf_dict[tokenizer.sep_token_id] = 0
+        self.idf_dict[tokenizer.cls_token_id] = 0
+        self.cache = LRUCache(CACHE_BYTES, getsizeof=_num_bytes)
+        self.lock = Lock()
+
+    def _key(self, text):
+        return MODEL, sha256(text.encode()).digest()
+
+    def _encode(self, texts):
+        """
+        returns the token embeddings and idf weights of every unique text, only
+        the texts that are not cached are encoded, longest first like
+        bert_score does to keep the padding small
+        """
+        stats = {}
+        with self.lock:
+            for text in set(texts):
+                cached = self.cache.get(self._key(text))
+                if cached is not None:
+                    stats[text] = cached
+        missing = sorted(
+            set(texts) - stats.keys(), key=lambda x: len(x.split(" ")), reverse=True
+        )
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start : start + BATCH_SIZE]
+            embeddings, masks, idf = get_bert_embedding(
+                batch,
+                self.bert._model,
+                self.bert._tokenizer,
+                self.idf_dict,
+                device=self.bert.device,
+            )
+            embeddings, masks, idf = embeddings.cpu(), masks.cpu(), idf.cpu()
+            for i, text in enumerate(batch):
+                length = masks[i].sum().item()
+                # copies, so that the cache does not keep the padded batch alive
+                stats[text] = (
+                    embeddings[i, :length].clone(),
+                    idf[i, :length].clone(),
+                )
+        with self.lock:
+            for text in missing:
+                try:
+                    self.cache[self._key(text)] = stats[text]
+                except ValueError:
+                    # larger than the whole cache
+                    pass
+        return stats
+
+    def _pad(self, stats):
+        embeddings, idf = zip(*stats)
+        lengths = torch.tensor([e.size(0) for e in embeddings])
+        # the padding of bert_score, greedy_cos_idf normalizes the padded copies
+        embeddings = pad_sequence(embeddings, batch_first=True, padding_value=2.0)
+        idf = pad_sequence(idf, batch_first=True)
+        mask = torch.arange(embeddings.size(1)).expand(len(lengths), -1)
+        mask = mask < lengths.unsqueeze(1)
+        device = self.bert.device
+        return embeddings.to(device), mask.to(device), idf.to(device)
 
     def evaluate(self, batch):
         hypotheses, references = zip(*batch)
-        return self.bert.score(hypotheses, references)[0].tolist()
+        stats = self._encode(hypotheses + references)
+        preds = []
+        with torch.no_grad():
+            for start in range(0, len(batch), BATCH_SIZE):
+                end = start + BATCH_SIZE
+                reference_stats = self._pad([stats[t] for t in references[start:end]])
+                hypothesis_stats = self._pad([stats[t] for t in hypotheses[start:end]])
+                P, R, F = greedy_cos_idf(
+                    *reference_stats, *hypothesis_stats, self.bert.all_layers
+                )
+                preds.append(torch.stack((P, R, F), dim=-1).cpu())
+        preds = torch.cat(preds)
+        baseline = self.bert.baseline_vals
+        preds = (preds - baseline) / (1 - baseline)
+        return preds[..., 2].tolist()
 
     def metadata(self):
         return {"model": MODEL}
@@ -1,5 +1,7 @@
 import sacrebleu
 
+from .batch_bleu import BatchBleu
+
 
 class Bleu:
     def __init__(
@@ -22,7 +24,7 @@ class Bleu:
                 :param use_effective_order: Account for references that are shorter than the largest n-gram.
                 :param force: Ignore data that looks already tokenized
                 :param lowercase: Lowercase the data
-                sent* parameters are the same but specify what is used for evaluate_example
+                sent* parameters are the same but specify what is used for sentence scores
 
         """
         self.sent_smooth_method = sent_smooth_method
@@ -33,18 +35,9 @@ class Bleu:
         self.force = force
         self.lowercase = lowercase
         self.use_effective_order = use_effective_order
-
-    def evaluate_example(self, summary, reference):
-        if isinstance(reference, str):
-            reference = [reference]
-        score = sacrebleu.sentence_bleu(
-            summary,
-            reference,
-            smooth_method=self.sent_smooth_method,
-            smooth_value=self.sent_smooth_value,
-            use_effective_order=self.sent_use_effective_order,
-        )
-        return score.score
+        # like sacrebleu.sentence_bleu, the sentence scores are not lowercased
+        self.sentence_bleu = BatchBleu()
+        self.corpus_bleu = BatchBleu(lowercase=lowercase)
 
     def compute_score(self, summaries, references, aggregate=True):
         if isinstance(summaries, str):
@@ -64,4 +57,29 @@ class Bleu:
                 use_effective_order=self.use_effective_order,
             )
             return score.score
-        return [self.evaluate_example(s, r) for s, r in zip(summaries, references)]
+        statistics = self.sentence_bleu.statistics(summaries, references)
+        return self._sentence_scores(statistics)
+
+    def _sentence_scores(self, statistics):
+        return statistics.scores(
+            smooth_method=self.sent_smooth_method,
+            smooth_value=self.sent_smooth_value,
+            effective_order=self.sent_use_effective_order,
+        ).tolist()
+
+    def compute_scores(self, summaries, references):
+        """
+        returns the corpus BLEU and the sentence BLEU of every pair from one
+        pass over the pairs, every reference is a string or a list of strings
+        """
+        statistics = self.sentence_bleu.statistics(summaries, references)
+        if self.lowercase:
+            corpus_statistics = self.corpus_bleu.statistics(summaries, references)
+        else:
+            corpus_statistics = statistics
+        corpus_score = corpus_statistics.sum().scores(
+            smooth_method=self.smooth_method,
+            smooth_value=self.smooth_value,
+            effective_order=self.use_effective_order,
+        )[0]
+        return float(corpus_score), self._sentence_scores(statistics)
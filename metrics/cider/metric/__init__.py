@@ -1,9 +1,21 @@
+import os
+
 from .cider import Cider
 
+# directory of the document frequencies built with metric/idf_index.py, without
+# an index the document frequencies are computed from the references of each
+# batch and the scores depend on the batching
+IDF_INDEX = os.environ.get("CIDER_IDF_INDEX")
+
 
 class MetricPlugin:
     def __init__(self):
-        self.cider = Cider()
+        idf_index = None
+        if IDF_INDEX:
+            from .idf_index import IdfIndex
+
+            idf_index = IdfIndex.load(IDF_INDEX)
+        self.cider = Cider(idf_index=idf_index)
 
     def evaluate(self, batch):
         hypotheses, references = zip(*batch)
@@ -13,7 +13,7 @@ def tokenize(document):
 
 
 class Cider:
-    def __init__(self, n_gram=4, sigma=6.0, tokenize=True):
+    def __init__(self, n_gram=4, sigma=6.0, tokenize=True, idf_index=None):
         """
         CIDEr metric
         Makes use of https://github.com/Maluuba/nlg-eval/tree/master/nlgeval/pycocoevalcap/cider
@@ -23,11 +23,18 @@ class Cider:
                 :param sigma: sigma used in Gaussian length penalty, described in Section 8 of original paper
                 :param tokenize: whether to apply basic tokenization to input; otherwise assumes that user has \
                         done any necessary tokenization
+                :param idf_index: precomputed document frequencies (IdfIndex), without an index the \
+                        document frequencies are computed from the references of each call
 
         """
+        if idf_index is not None and idf_index.n < n_gram:
+            raise ValueError(
+                f"the idf index contains {idf_index.n}-grams but {n_gram}-grams are needed"
+            )
         self.n_gram = n_gram
         self.sigma = sigma
         self.tokenize = tokenize
+        self.idf_index = idf_index
 
     def compute_score(self, summaries, references, aggregate=True):
         if isinstance(summaries, str):
@@ -43,7 +50,9 @@ class Cider:
                     for reference in references
                 ]
             summaries = [" ".join(tokenize(summary)) for summary in summaries]
-        cider_scorer = CiderScorer(n=self.n_gram, sigma=self.sigma)
+        cider_scorer = CiderScorer(
+            n=self.n_gram, sigma=self.sigma, idf_index=self.idf_index
+        )
         for summ, ref in zip(summaries, references):
             if not isinstance(ref, list):
                 ref = [ref]
@@ -3,28 +3,10 @@
 # Ramakrishna Vedantam <vrama91@vt.edu>
 
 import copy
-import math
-from collections import defaultdict
+from itertools import chain
 
 import numpy as np
-
-
-def precook(s, n=4, out=False):
-    """
-    Takes a string as input and returns an object that can be given to
-    either cook_refs or cook_test. This is optional: cook_refs and cook_test
-    can take string arguments as well.
-    :param s: string : sentence to be converted into ngrams
-    :param n: int    : number of ngrams for which representation is calculated
-    :return: term frequency vector for occuring ngrams
-    """
-    words = s.split()
-    counts = defaultdict(int)
-    for k in range(1, n + 1):
-        for i in range(len(words) - k + 1):
-            ngram = tuple(words[i : i + k])
-            counts[ngram] += 1
-    return counts
+from scipy import sparse
 
 
 def cook_refs(refs, n=4):  ## lhuang: oracle will call with "average"
@@ -32,20 +14,24 @@ def cook_refs(refs, n=4):  ## lhuang: oracle will call with "average"
     and returns an object that encapsulates everything that BLEU
     needs to know about them.
     :param refs: list of string : reference sentences for some image
-    :param n: int : number of ngrams for which (ngram) representation is calculated
-    :return: result (list of dict)
+    :param n: int : unused, the n-grams are counted in CiderScorer.compute_cider
+    :return: result (list of list of string)
     """
-    return [precook(ref, n) for ref in refs]
+    return [ref.split() for ref in refs]
 
 
 def cook_test(test, n=4):
     """Takes a test sentence and returns an object that
     encapsulates everything that BLEU needs to know about it.
     :param test: list of string : hypothesis sentence for some image
-    :param n: int : number of ngrams for which (ngram) representation is calculated
-    :return: result (dict)
+    :param n: int : unused, the n-grams are counted in CiderScorer.compute_cider
+    :return: result (list of string)
     """
-    return precook(test, n, True)
+    return test.split()
+
+
+def _row_sums(matrix):
+    return np.asarray(matrix.sum(axis=1)).ravel()
 
 
 class CiderScorer(object):
@@ -53,18 +39,18 @@ class CiderScorer(object):
 
     def copy(self):
         """copy the refs."""
-        new = CiderScorer(n=self.n)
+        new = CiderScorer(n=self.n, sigma=self.sigma, idf_index=self.idf_index)
         new.ctest = copy.copy(self.ctest)
         new.crefs = copy.copy(self.crefs)
         return new
 
-    def __init__(self, test=None, refs=None, n=4, sigma=6.0):
+    def __init__(self, test=None, refs=None, n=4, sigma=6.0, idf_index=None):
         """singular instance"""
         self.n = n
         self.sigma = sigma
+        self.idf_index = idf_index
         self.crefs = []
         self.ctest = []
-        self.document_frequency = defaultdict(float)
         self.cook_append(test, refs)
         self.ref_len = None
 
@@ -97,103 +83,149 @@ class CiderScorer(object):
 
         return self
 
-    def compute_doc_freq(self):
+    def _example_matrix(self, ref_examples):
+        """
+        :param ref_examples: array of int : example of every reference
+        :return: csr matrix that sums the rows of the references of every example
+        """
+        return sparse.csr_matrix(
+            (np.ones(len(ref_examples)), (ref_examples, np.arange(len(ref_examples)))),
+            shape=(len(self.crefs), len(ref_examples)),
+        )
+
+    def _count_matrices(self, texts):
+        """
+        Interns the n-grams of every order to integer ids, the ids of order k
+        are the unique pairs of an (k-1)-gram id and the id of the next word.
+        :param texts: list of list of string : tokenized sentences
+        :return: per order the csr matrix of n-gram counts with one row per
+                 sentence and the position of the first occurrence of every n-gram
+        """
+        words = list(chain.from_iterable(texts))
+        vocabulary = {word: i for i, word in enumerate(dict.fromkeys(words))}
+        word_ids = np.fromiter(map(vocabulary.__getitem__, words), dtype=np.int64)
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        # number of words from every position to the end of its sentence
+        remaining = lengths[rows] - (np.arange(len(words)) - starts[rows])
+        matrices = []
+        positions = []
+        ids = word_ids
+        num_ids = len(vocabulary)
+        # the first occurrences are only needed to look up the n-grams in the
+        # idf index and require a stable sort
+        return_index = self.idf_index is not None
+        for k in range(1, self.n + 1):
+            valid = np.flatnonzero(remaining >= k)
+            if k > 1:
+                keys = ids[valid] * len(vocabulary) + word_ids[valid + k - 1]
+                unique = np.unique(
+                    keys, return_index=return_index, return_inverse=True
+                )
+                ids = np.full(len(words), -1, dtype=np.int64)
+                ids[valid] = unique[-1]
+                num_ids = len(unique[0])
+                first = valid[unique[1]] if return_index else None
+            elif return_index:
+                first = np.unique(word_ids, return_index=True)[1]
+            else:
+                first = None
+            counts = sparse.csr_matrix(
+                (np.ones(len(valid)), (rows[valid], ids[valid])),
+                shape=(len(texts), num_ids),
+            )
+            counts.sum_duplicates()
+            matrices.append(counts)
+            positions.append(first)
+        return matrices, words, positions
+
+    def compute_doc_freq(self, ref_counts, ref_examples):
         """
         Compute term frequency for reference data.
         This will be used to compute idf (inverse document frequency later)
-        The term frequency is stored in the object
-        :return: None
+        :param ref_counts: csr matrix : n-gram counts of every reference
+        :param ref_examples: array of int : example of every reference
+        :return: document frequency of every n-gram (array of float)
+        """
+        presence = ref_counts.copy()
+        presence.data[:] = 1
+        # refs, k ref captions of one image
+        examples = self._example_matrix(ref_examples)
+        return np.asarray(((examples @ presence) > 0).sum(axis=0), dtype=float).ravel()
+
+    def load_doc_freq(self, ngrams):
         """
-        for refs in self.crefs:
-            # refs, k ref captions of one image
-            for ngram in set([ngram for ref in refs for (ngram, count) in ref.items()]):
-                self.document_frequency[ngram] += 1
-            # maxcounts[ngram] = max(maxcounts.get(ngram,0), count)
+        Looks up the document frequencies of the n-grams in the precomputed
+        index, so that the score of a pair does not depend on the other pairs
+        of the batch
+        :param ngrams: list of tuple : n-grams
+        :return: document frequency of every n-gram (array of float)
+        """
+        return self.idf_index.lookup(ngrams)
 
     def compute_cider(self):
-        def counts2vec(cnts):
-            """
-            Function maps counts of ngram to vector of tfidf weights.
-            The function returns vec, an array of dictionary that store mapping of n-gram and tf-idf weights.
-            The n-th entry of array denotes length of n-grams.
-            :param cnts:
-            :return: vec (array of dict), norm (array of float), length (int)
-            """
-            vec = [defaultdict(float) for _ in range(self.n)]
-            length = 0
-            norm = [0.0 for _ in range(self.n)]
-            for (ngram, term_freq) in cnts.items():
-                # give word count 1 if it doesn't appear in reference corpus
-                df = np.log(max(1.0, self.document_frequency[ngram]))
-                # ngram index
-                n = len(ngram) - 1
-                # tf (term_freq) * idf (precomputed idf) for n-grams
-                vec[n][ngram] = float(term_freq) * (self.ref_len - df)
-                # compute norm for the vector.  the norm will be used for computing similarity
-                norm[n] += pow(vec[n][ngram], 2)
-
-                if n == 1:
-                    length += term_freq
-            norm = [np.sqrt(n) for n in norm]
-            return vec, norm, length
-
-        def sim(vec_hyp, vec_ref, norm_hyp, norm_ref, length_hyp, length_ref):
-            """
-            Compute the cosine similarity of two vectors.
-            :param vec_hyp: array of dictionary for vector corresponding to hypothesis
-            :param vec_ref: array of dictionary for vector corresponding to reference
-            :param norm_hyp: array of float for vector corresponding to hypothesis
-            :param norm_ref: array of float for vector corresponding to reference
-            :param length_hyp: int containing length of hypothesis
-            :param length_ref: int containing length of reference
-            :return: array of score for each n-grams cosine similarity
-            """
-            delta = float(length_hyp - length_ref)
-            # measure consine similarity
-            val = np.array([0.0 for _ in range(self.n)])
-            for n in range(self.n):
-                # ngram
-                for (ngram, count) in vec_hyp[n].items():
-                    # vrama91 : added clipping
-                    val[n] += (
-                        min(vec_hyp[n][ngram], vec_ref[n][ngram]) * vec_ref[n][ngram]
-                    )
-
-                if (norm_hyp[n] != 0) and (norm_ref[n] != 0):
-                    val[n] /= norm_hyp[n] * norm_ref[n]
-
-                assert not math.isnan(val[n])
-                # vrama91: added a length based gaussian penalty
-                val[n] *= np.e ** (-(delta**2) / (2 * self.sigma**2))
-            return val
+        """
+        Computes per n-gram order the tf-idf vectors of all hypotheses and
+        references as sparse matrices and the clipped cosine similarities of
+        all hypothesis-reference pairs in bulk.
+        :return: scores (array of float)
+        """
+        refs = [ref for refs in self.crefs for ref in refs]
+        tests = [[] if test is None else test for test in self.ctest]
+        num_refs = np.array([len(refs) for refs in self.crefs])
+        ref_examples = np.repeat(np.arange(len(self.crefs)), num_refs)
+        matrices, words, positions = self._count_matrices(tests + refs)
+
+        val = np.zeros((len(refs), self.n))
+        for n, (counts, first) in enumerate(zip(matrices, positions)):
+            hyp_counts = counts[: len(tests)]
+            ref_counts = counts[len(tests) :]
+            if self.idf_index is not None:
+                ngrams = [tuple(words[i : i + n + 1]) for i in first.tolist()]
+                document_frequency = self.load_doc_freq(ngrams)
+            else:
+                document_frequency = self.compute_doc_freq(ref_counts, ref_examples)
+                # assert to check document frequency
+                assert len(self.ctest) >= document_frequency.max(initial=0)
+            # give word count 1 if it doesn't appear in reference corpus
+            idf = self.ref_len - np.log(np.maximum(1.0, document_frequency))
+            # tf (term_freq) * idf (precomputed idf) for n-grams
+            hyp_vec = hyp_counts @ sparse.diags(idf)
+            ref_vec = ref_counts @ sparse.diags(idf)
+            # compute norm for the vector.  the norm will be used for computing similarity
+            hyp_norm = np.sqrt(_row_sums(hyp_vec.multiply(hyp_vec)))
+            ref_norm = np.sqrt(_row_sums(ref_vec.multiply(ref_vec)))
+            # vrama91 : added clipping, tf-idf weights are never negative, so
+            # the minimum is zero where either vector has no entry
+            clipped = hyp_vec[ref_examples].minimum(ref_vec).multiply(ref_vec)
+            val[:, n] = _row_sums(clipped)
+            denominator = hyp_norm[ref_examples] * ref_norm
+            np.divide(val[:, n], denominator, out=val[:, n], where=denominator != 0)
+
+        # the length is the number of bigrams
+        lengths = np.array([max(len(text) - 1, 0) for text in tests + refs])
+        # vrama91: added a length based gaussian penalty
+        delta = (lengths[: len(tests)][ref_examples] - lengths[len(tests) :]).astype(
+            float
+        )
+        val *= (np.e ** (-(delta**2) / (2 * self.sigma**2)))[:, None]
 
-        # compute log reference length
-        self.ref_len = np.log(float(len(self.crefs)))
-
-        scores = []
-        for test, refs in zip(self.ctest, self.crefs):
-            # compute vector for test captions
-            vec, norm, length = counts2vec(test)
-            # compute vector for ref captions
-            score = np.array([0.0 for _ in range(self.n)])
-            for ref in refs:
-                vec_ref, norm_ref, length_ref = counts2vec(ref)
-                score += sim(vec, vec_ref, norm, norm_ref, length, length_ref)
-            # change by vrama91 - mean of ngram scores, instead of sum
-            score_avg = np.mean(score)
-            # divide by number of references
-            score_avg /= len(refs)
-            # multiply score by 10
-            score_avg *= 10.0
-            # append score of an image to the score list
-            scores.append(score_avg)
-        return scores
+        score = self._example_matrix(ref_examples) @ val
+        # change by vrama91 - mean of ngram scores, instead of sum
+        score_avg = np.mean(score, axis=1)
+        # divide by number of references
+        score_avg /= num_refs
+        # multiply score by 10
+        score_avg *= 10.0
+        return score_avg
 
     def compute_score(self, option=None, verbose=0):
-        # compute idf
-        self.compute_doc_freq()
-        # assert to check document frequency
-        assert len(self.ctest) >= max(self.document_frequency.values())
+        # compute log reference length
+        if self.idf_index is not None:
+            self.ref_len = np.log(float(self.idf_index.documents))
+        else:
+            self.ref_len = np.log(float(len(self.crefs)))
         # compute cider score
         score = self.compute_cider()
         # debug
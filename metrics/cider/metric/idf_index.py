@@ -0,0 +1,162 @@
+"""
+persistent document frequencies of n-grams for CIDEr
+
+the index is a directory with the sorted 8 byte blake2b hashes of the n-grams,
+their document frequencies and the number of documents, the arrays are loaded
+memory-mapped and looked up with a binary search
+
+build or extend an index from a corpus with one reference per line:
+python -m metric.idf_index CORPUS INDEX [--accumulate]
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+from hashlib import blake2b
+from pathlib import Path
+
+import numpy as np
+
+from .cider import tokenize
+
+HASHES_FILE = "hashes.npy"
+FREQUENCIES_FILE = "frequencies.npy"
+META_FILE = "meta.json"
+
+
+def ngram_hash(ngram):
+    # the words of an n-gram never contain whitespace
+    digest = blake2b(" ".join(ngram).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def ngram_hashes(ngrams):
+    return np.fromiter((ngram_hash(ngram) for ngram in ngrams), dtype=np.uint64)
+
+
+def _save_array(path, array):
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class IdfIndex:
+    def __init__(self, hashes, frequencies, documents, n):
+        self.hashes = hashes
+        self.frequencies = frequencies
+        self.documents = documents
+        self.n = n
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads((path / META_FILE).read_text())
+        return cls(
+            np.load(path / HASHES_FILE, mmap_mode="r"),
+            np.load(path / FREQUENCIES_FILE, mmap_mode="r"),
+            meta["documents"],
+            meta["n"],
+        )
+
+    @classmethod
+    def from_counts(cls, counts, documents, n):
+        hashes = np.fromiter(counts.keys(), dtype=np.uint64, count=len(counts))
+        frequencies = np.fromiter(counts.values(), dtype=np.uint32, count=len(counts))
+        order = np.argsort(hashes)
+        return cls(hashes[order], frequencies[order], documents, n)
+
+    def merge(self, other):
+        if self.n != other.n:
+            raise ValueError(
+                f"cannot merge indices of {self.n}-grams and {other.n}-grams"
+            )
+        hashes, inverse = np.unique(
+            np.concatenate([self.hashes, other.hashes]), return_inverse=True
+        )
+        frequencies = np.bincount(
+            inverse, weights=np.concatenate([self.frequencies, other.frequencies])
+        ).astype(np.uint32)
+        return IdfIndex(hashes, frequencies, self.documents + other.documents, self.n)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        _save_array(path / HASHES_FILE, np.asarray(self.hashes))
+        _save_array(path / FREQUENCIES_FILE, np.asarray(self.frequencies))
+        (path / META_FILE).write_text(
+            json.dumps({"documents": self.documents, "n": self.n})
+        )
+
+    def lookup(self, ngrams):
+        """
+        returns the document frequencies of the n-grams, 0 for unknown n-grams
+        """
+        hashes = ngram_hashes(ngrams)
+        if not len(self.hashes):
+            return np.zeros(len(hashes))
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        found = self.hashes[positions] == hashes
+        return np.where(found, self.frequencies[positions], 0).astype(np.float64)
+
+
+def count_documents(documents, n=4):
+    """
+    counts in how many documents every n-gram up to length n occurs, a
+    document is a tokenized string
+    """
+    counts = Counter()
+    num_documents = 0
+    for document in documents:
+        words = document.split()
+        ngrams = {
+            tuple(words[i : i + k])
+            for k in range(1, n + 1)
+            for i in range(len(words) - k + 1)
+        }
+        counts.update(ngram_hash(ngram) for ngram in ngrams)
+        num_documents += 1
+    return IdfIndex.from_counts(counts, num_documents, n)
+
+
+def build_index(corpus_path, index_path, n=4, accumulate=False, field=None):
+    """
+    builds the index from a corpus with one reference per line or a jsonl
+    file whose lines contain the reference in `field`, with `accumulate` the
+    counts are added to an existing index
+    """
+
+    def documents():
+        with open(corpus_path, encoding="utf-8") as file:
+            for line in file:
+                text = json.loads(line)[field] if field else line
+                yield " ".join(tokenize(text))
+
+    index = count_documents(documents(), n)
+    if accumulate and (Path(index_path) / META_FILE).exists():
+        index = IdfIndex.load(index_path).merge(index)
+    index.save(index_path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build the CIDEr idf index")
+    parser.add_argument("corpus", help="file with one reference per line")
+    parser.add_argument("index", help="directory of the index")
+    parser.add_argument(
+        "--accumulate",
+        action="store_true",
+        help="add the corpus to an existing index instead of replacing it",
+    )
+    parser.add_argument(
+        "--field", help="read the corpus as jsonl and use this field as reference"
+    )
+    parser.add_argument("-n", type=int, default=4, help="maximal n-gram length")
+    args = parser.parse_args()
+    index = build_index(args.corpus, args.index, args.n, args.accumulate, args.field)
+    print(f"{len(index.hashes)} n-grams in {index.documents} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+
+from metric.idf_index import build_index
+
+# builds the idf index during the setup when a reference corpus is given
+CORPUS = os.environ.get("CIDER_IDF_CORPUS")
+IDF_INDEX = os.environ.get("CIDER_IDF_INDEX")
+
+
+def setup():
+    if CORPUS and IDF_INDEX:
+        build_index(CORPUS, IDF_INDEX)
+
+
+if __name__ == "__main__":
+    setup()
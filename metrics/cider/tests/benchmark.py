@@ -0,0 +1,60 @@
+"""
+time of CiderScorer and the dictionary based implementation it replaced,
+run from metrics/cider:
+python -m tests.benchmark [--pairs N] [--references N]
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from metric.cider_scorer import CiderScorer
+from metric.idf_index import count_documents
+from tests.reference_cider_scorer import CiderScorer as ReferenceCiderScorer
+
+
+def text(rng, vocabulary, length):
+    return " ".join(rng.choice(vocabulary) for _ in range(length))
+
+
+def run(scorer_class, pairs, idf_index):
+    start = time.perf_counter()
+    scorer = scorer_class(n=4, sigma=6.0, idf_index=idf_index)
+    for hypothesis, references in pairs:
+        scorer += (hypothesis, references)
+    scores = np.array(scorer.compute_score())
+    return scores, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pairs", type=int, default=10000)
+    parser.add_argument("--references", type=int, default=5, help="per pair")
+    parser.add_argument("--length", type=int, default=20, help="words per text")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    pairs = [
+        (
+            text(rng, vocabulary, args.length),
+            [text(rng, vocabulary, args.length) for _ in range(args.references)],
+        )
+        for _ in range(args.pairs)
+    ]
+    idf_index = count_documents(ref for _, refs in pairs for ref in refs)
+    print(f"{args.pairs} pairs with {args.references} references each")
+    for name, index in [("batch document frequencies", None), ("idf index", idf_index)]:
+        expected, reference_time = run(ReferenceCiderScorer, pairs, index)
+        scores, new_time = run(CiderScorer, pairs, index)
+        print(
+            f"{name:28} reference {reference_time:7.2f}s  CiderScorer {new_time:7.2f}s"
+            f"  x{reference_time / new_time:5.1f}"
+            f"  max difference {np.abs(scores - expected).max():.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
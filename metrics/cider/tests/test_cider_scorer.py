@@ -0,0 +1,63 @@
+"""
+parity of CiderScorer with the dictionary based implementation it replaced,
+run from metrics/cider:
+python -m unittest discover tests
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from metric.cider_scorer import CiderScorer
+from metric.idf_index import count_documents
+from tests.reference_cider_scorer import CiderScorer as ReferenceCiderScorer
+
+WORDS = [f"w{i}" for i in range(50)]
+
+
+def random_text(rng, length):
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def scores(scorer_class, pairs, idf_index=None):
+    scorer = scorer_class(n=4, sigma=6.0, idf_index=idf_index)
+    for hypothesis, references in pairs:
+        scorer += (hypothesis, references)
+    return np.array(scorer.compute_score())
+
+
+class CiderScorerParityTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.pairs = [
+            (
+                random_text(rng, rng.randint(0, 20)),
+                [random_text(rng, rng.randint(1, 25)) for _ in range(rng.randint(1, 4))],
+            )
+            for _ in range(500)
+        ]
+        # texts that are shorter than the n-gram order and empty texts
+        self.pairs += [("", ["w1 w2"]), ("w1", ["w1"]), ("w1 w2", ["", "w1 w2 w3"])]
+        corpus = [random_text(rng, rng.randint(1, 25)) for _ in range(1000)]
+        self.idf_index = count_documents(corpus)
+
+    def test_document_frequencies_of_the_batch(self):
+        np.testing.assert_allclose(
+            scores(CiderScorer, self.pairs),
+            scores(ReferenceCiderScorer, self.pairs),
+            rtol=0,
+            atol=1e-12,
+        )
+
+    def test_document_frequencies_of_an_index(self):
+        np.testing.assert_allclose(
+            scores(CiderScorer, self.pairs, self.idf_index),
+            scores(ReferenceCiderScorer, self.pairs, self.idf_index),
+            rtol=0,
+            atol=1e-12,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,11 +9,17 @@ import logging
 import os
 import re
 import subprocess
-import sys
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Assumes meteor-1.5.jar is in the same directory as meteor.py.  Change as needed.
 METEOR_JAR = 'meteor-1.5.jar'
+# number of METEOR JVMs, every JVM needs up to 2G of memory
+METEOR_PROCESSES = int(os.environ.get('METEOR_PROCESSES', 1))
+
+WARM_UP_PAIR = ('a cat sat on the mat', ['the cat was sitting on the mat'])
+
+logger = logging.getLogger(__name__)
 
 
 def enc(s):
@@ -24,12 +30,31 @@ def dec(s):
     return s.decode('utf-8')
 
 
-class Meteor:
+def score_line(hypothesis_str, reference_list):
+    # SCORE ||| reference 1 words ||| reference n words ||| hypothesis words
+    hypothesis_str = hypothesis_str.replace('|||', '')
+    line = ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
+    return re.sub(r'\s+', ' ', line)
+
+
+class MeteorCrashed(Exception):
+    pass
+
+
+class MeteorProcess:
+    """
+    one METEOR JVM in stdio mode, all SCORE lines of a batch are written by a
+    writer thread while their stats are read, so that the JVM never waits for
+    a round trip and the pipes can not fill up
+    """
 
     def __init__(self):
         # Used to guarantee thread safety
         self.lock = threading.Lock()
+        self.meteor_p = None
+        self._start()
 
+    def _start(self):
         mem = '2G'
         meteor_cmd = ['java', '-jar', '-Xmx{}'.format(mem), METEOR_JAR,
                       '-', '-', '-stdio', '-l', 'en', '-norm']
@@ -40,16 +65,96 @@ class Meteor:
                                          env=env,
                                          stdin=subprocess.PIPE,
                                          stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
+                                         stderr=subprocess.DEVNULL)
 
-        atexit.register(self.close)
+    def _kill(self):
+        if self.meteor_p:
+            self.meteor_p.kill()
+            self.meteor_p.wait()
+            self.meteor_p = None
+
+    def _restart(self):
+        self._kill()
+        self._start()
 
     def close(self):
         with self.lock:
-            if self.meteor_p:
-                self.meteor_p.kill()
-                self.meteor_p.wait()
-                self.meteor_p = None
+            self._kill()
+
+    def _readline(self):
+        line = self.meteor_p.stdout.readline()
+        if not line:
+            raise MeteorCrashed('the METEOR process closed its output')
+        return dec(line).strip()
+
+    def _write(self, lines):
+        try:
+            for line in lines:
+                self.meteor_p.stdin.write(enc('{}\n'.format(line)))
+            self.meteor_p.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # the reader notices that the process exited
+            pass
+
+    def _stats(self, lines):
+        writer = threading.Thread(target=self._write, args=(lines,))
+        writer.start()
+        try:
+            return [self._readline() for _ in lines]
+        finally:
+            writer.join()
+
+    def _eval(self, stats):
+        # EVAL ||| stats 1 ||| stats n, returns one score per stats and the
+        # score of all stats
+        self._write([' ||| '.join(['EVAL', *stats])])
+        scores = [self._read_score() for _ in stats]
+        score = self._read_score()
+        return score, scores
+
+    def _read_score(self):
+        v = self._readline()
+        try:
+            return float(v)
+        except ValueError:
+            # the output is out of sync, the process has to be restarted
+            raise MeteorCrashed(
+                'METEOR returned the invalid score {!r}'.format(v))
+
+    def _run(self, function, argument):
+        with self.lock:
+            try:
+                if self.meteor_p is None or self.meteor_p.poll() is not None:
+                    raise MeteorCrashed('the METEOR process is not running')
+                return function(argument)
+            except MeteorCrashed as error:
+                logger.warning('%s, restarting it', error)
+                self._restart()
+                return function(argument)
+
+    def stats(self, lines):
+        return self._run(self._stats, lines)
+
+    def eval(self, stats):
+        return self._run(self._eval, stats)
+
+    def warm_up(self):
+        self.eval(self.stats([score_line(*WARM_UP_PAIR)]))
+
+
+class Meteor:
+
+    def __init__(self, processes=METEOR_PROCESSES):
+        self.processes = [MeteorProcess() for _ in range(max(1, processes))]
+        self.executor = ThreadPoolExecutor(len(self.processes))
+        # the JVMs load the paraphrase tables and compile in parallel
+        list(self.executor.map(MeteorProcess.warm_up, self.processes))
+        atexit.register(self.close)
+
+    def close(self):
+        for process in self.processes:
+            process.close()
+        self.executor.shutdown(wait=False)
         # if the user calls close() manually, remove the
         # reference from atexit so the object can be garbage-collected.
         if atexit is not None and atexit.unregister is not None:
@@ -58,63 +163,27 @@ class Meteor:
     def compute_score(self, gts, res):
         assert (gts.keys() == res.keys())
         imgIds = gts.keys()
-        scores = []
-
-        eval_line = 'EVAL'
-        with self.lock:
-            for i in imgIds:
-                assert (len(res[i]) == 1)
-                stat = self._stat(res[i][0], gts[i])
-                eval_line += ' ||| {}'.format(stat)
-
-            self.meteor_p.stdin.write(enc('{}\n'.format(eval_line)))
-            self.meteor_p.stdin.flush()
-            for i in range(0, len(imgIds)):
-                v = self.meteor_p.stdout.readline()
-                try:
-                    scores.append(float(dec(v.strip())))
-                except:
-                    sys.stderr.write("Error handling value: {}\n".format(v))
-                    sys.stderr.write("Decoded value: {}\n".format(dec(v.strip())))
-                    sys.stderr.write("eval_line: {}\n".format(eval_line))
-                    # You can try uncommenting the next code line to show stderr from the Meteor JAR.
-                    # If the Meteor JAR is not writing to stderr, then the line will just hang.
-                    # sys.stderr.write("Error from Meteor:\n{}".format(self.meteor_p.stderr.read()))
-                    raise
-            score = float(dec(self.meteor_p.stdout.readline()).strip())
-
-        return score, scores
+        lines = []
+        for i in imgIds:
+            assert (len(res[i]) == 1)
+            lines.append(score_line(res[i][0], gts[i]))
+        if not lines:
+            return 0.0, []
+
+        # the batch is sharded across the JVMs, the stats are combined in one
+        # EVAL so that the score of all pairs is the same as with a single JVM
+        shard_size = -(-len(lines) // len(self.processes))
+        shards = [lines[i:i + shard_size] for i in range(0, len(lines), shard_size)]
+        stats = [
+            s
+            for shard_stats in self.executor.map(
+                MeteorProcess.stats, self.processes, shards)
+            for s in shard_stats
+        ]
+        return self.processes[0].eval(stats)
 
     def method(self):
         return "METEOR"
 
-    def _stat(self, hypothesis_str, reference_list):
-        # SCORE ||| reference 1 words ||| reference n words ||| hypothesis words
-        hypothesis_str = hypothesis_str.replace('|||', '')
-        score_line = ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
-        score_line = re.sub(r'\s+', ' ', score_line)
-        self.meteor_p.stdin.write(enc(score_line))
-        self.meteor_p.stdin.write(enc('\n'))
-        self.meteor_p.stdin.flush()
-        return dec(self.meteor_p.stdout.readline()).strip()
-
-    def _score(self, hypothesis_str, reference_list):
-        with self.lock:
-            # SCORE ||| reference 1 words ||| reference n words ||| hypothesis words
-            hypothesis_str = hypothesis_str.replace('|||', '').replace('  ', ' ')
-            score_line = ' ||| '.join(('SCORE', ' ||| '.join(reference_list), hypothesis_str))
-            self.meteor_p.stdin.write(enc('{}\n'.format(score_line)))
-            self.meteor_p.stdin.flush()
-            stats = dec(self.meteor_p.stdout.readline()).strip()
-            eval_line = 'EVAL ||| {}'.format(stats)
-            # EVAL ||| stats
-            self.meteor_p.stdin.write(enc('{}\n'.format(eval_line)))
-            self.meteor_p.stdin.flush()
-            score = float(dec(self.meteor_p.stdout.readline()).strip())
-            # bug fix: there are two values returned by the jar file, one average, and one all, so do it twice
-            # thanks for Andrej for pointing this out
-            score = float(dec(self.meteor_p.stdout.readline()).strip())
-        return score
-
     def __del__(self):
         self.close()
@@ -1,23 +1,18 @@
-from os import environ
+from rouge_engine import RougeEngine
 
-from rouge import Rouge
-
-model = environ["model"]
-
-AVAILABLE_MODELS = {"1", "2", "l"}
-if model not in AVAILABLE_MODELS:
-    raise ValueError(f"invalid model {model}, needs to be one of {AVAILABLE_MODELS}")
+VARIANTS = {"1": "ROUGE-1", "2": "ROUGE-2", "l": "ROUGE-L"}
 
 
 class MetricPlugin:
     def __init__(self):
-        self.rouge = Rouge()
-        self.key = f"rouge-{model}"
+        self.rouge = RougeEngine()
 
     def evaluate(self, batch):
         hypotheses, references = zip(*batch)
-        scores = self.rouge.get_scores(hypotheses, references, avg=False)
-        return [score[self.key]["f"] for score in scores]
+        return self.rouge.get_scores(hypotheses, references)
 
-    def metadata(self):
-        return {"model": model}
+    def variants(self):
+        return {
+            variant: {"name": name, "select": [variant, "f"]}
+            for variant, name in VARIANTS.items()
+        }
@@ -0,0 +1,176 @@
+"""
+ROUGE-1, ROUGE-2 and ROUGE-L with the semantics of pltrdy/rouge
+
+tokens are interned to integer ids, the n-grams of a text are the unique packed
+id tuples in a sorted numpy array and the overlap of two texts is the size of
+the intersection of their arrays, ROUGE-L uses a bit-parallel LCS whose rows
+are kept to reconstruct the same subsequence as the dynamic program of
+pltrdy/rouge, texts are tokenized once and cached across pairs
+"""
+
+from threading import Lock
+
+import numpy as np
+from cachetools import LRUCache
+
+# the vocabulary and the cache are reset when the vocabulary reaches this size,
+# ids are packed into 64 bit integers with 31 bits per id for bigrams
+MAX_VOCABULARY = 2_000_000
+EPSILON = 1e-8
+
+
+class Text:
+    __slots__ = ("sentences", "ids", "unigrams", "bigrams", "masks")
+
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.ids = (
+            np.concatenate(sentences) if sentences else np.empty(0, dtype=np.int64)
+        )
+        self.unigrams = np.unique(self.ids)
+        self.bigrams = np.unique((self.ids[:-1] << 31) | self.ids[1:])
+        self.masks = None
+
+    def match_masks(self):
+        """
+        for every sentence a dictionary that maps each token id to the bitmask
+        of its positions in the sentence
+        """
+        if self.masks is None:
+            self.masks = []
+            for sentence in self.sentences:
+                masks = {}
+                for position, token in enumerate(sentence.tolist()):
+                    masks[token] = masks.get(token, 0) | (1 << position)
+                self.masks.append(masks)
+        return self.masks
+
+
+def split_sentences(text):
+    # pltrdy/rouge splits at every '.', drops empty parts and normalizes the
+    # whitespace, a part that only consists of whitespace becomes one empty token
+    return [" ".join(part.split()) for part in text.split(".") if part]
+
+
+def _lcs_rows(reference, masks, length):
+    """
+    rows of the bit-parallel LCS (Hyyrö) of the reference sentence against the
+    hypothesis sentence, a zero bit j of row i means that the LCS of
+    reference[:i] and hypothesis[:j + 1] is one longer than the one of
+    reference[:i] and hypothesis[:j]
+    """
+    full = (1 << length) - 1
+    row = full
+    rows = [row]
+    for token in reference:
+        match = row & masks.get(token, 0)
+        row = ((row + match) | (row - match)) & full
+        rows.append(row)
+    return rows
+
+
+def _lcs_tokens(reference, hypothesis, masks):
+    """
+    the tokens of the longest common subsequence that the backtracking of
+    pltrdy/rouge reconstructs
+    """
+    i, j = len(reference), len(hypothesis)
+    rows = _lcs_rows(reference, masks, j)
+
+    def table(i, j):
+        return j - (rows[i] & ((1 << j) - 1)).bit_count()
+
+    tokens = set()
+    while i > 0 and j > 0:
+        if reference[i - 1] == hypothesis[j - 1]:
+            tokens.add(reference[i - 1])
+            i -= 1
+            j -= 1
+        elif table(i - 1, j) > table(i, j - 1):
+            i -= 1
+        else:
+            j -= 1
+    return tokens
+
+
+def _scores(overlap, evaluated, reference):
+    precision = overlap / evaluated if evaluated else 0.0
+    recall = overlap / reference if reference else 0.0
+    f = 2.0 * ((precision * recall) / (precision + recall + EPSILON))
+    return {"f": f, "p": precision, "r": recall}
+
+
+def _overlap(first, second):
+    return np.intersect1d(first, second, assume_unique=True).size
+
+
+class RougeEngine:
+    def __init__(self, cache_size=100000):
+        self.vocabulary = {}
+        self.cache = LRUCache(cache_size)
+        self.lock = Lock()
+
+    def _intern(self, sentence):
+        vocabulary = self.vocabulary
+        ids = [
+            vocabulary.setdefault(token, len(vocabulary))
+            for token in sentence.split(" ")
+        ]
+        return np.array(ids, dtype=np.int64)
+
+    def _text(self, text):
+        cached = self.cache.get(text)
+        if cached is None:
+            cached = Text(
+                [self._intern(sentence) for sentence in split_sentences(text)]
+            )
+            self.cache[text] = cached
+        return cached
+
+    def _rouge_l(self, hypothesis, reference):
+        union = set()
+        hypothesis_sentences = [s.tolist() for s in hypothesis.sentences]
+        masks = hypothesis.match_masks()
+        for reference_sentence in reference.sentences:
+            reference_sentence = reference_sentence.tolist()
+            for hypothesis_sentence, sentence_masks in zip(
+                hypothesis_sentences, masks
+            ):
+                union |= _lcs_tokens(
+                    reference_sentence, hypothesis_sentence, sentence_masks
+                )
+        return _scores(len(union), hypothesis.unigrams.size, reference.unigrams.size)
+
+    def score(self, hypothesis, reference):
+        if not hypothesis.sentences:
+            raise ValueError("Hypothesis is empty.")
+        if not reference.sentences:
+            raise ValueError("Reference is empty.")
+        return {
+            "1": _scores(
+                _overlap(hypothesis.unigrams, reference.unigrams),
+                hypothesis.unigrams.size,
+                reference.unigrams.size,
+            ),
+            "2": _scores(
+                _overlap(hypothesis.bigrams, reference.bigrams),
+                hypothesis.bigrams.size,
+                reference.bigrams.size,
+            ),
+            "l": self._rouge_l(hypothesis, reference),
+        }
+
+    def get_scores(self, hypotheses, references):
+        """
+        returns {variant: {"f", "p", "r"}} for every pair with the variants
+        '1', '2' and 'l'
+        """
+        with self.lock:
+            if len(self.vocabulary) >= MAX_VOCABULARY:
+                self.vocabulary.clear()
+                self.cache.clear()
+            pairs = [
+                (self._text(hypothesis), self._text(reference))
+                for hypothesis, reference in zip(hypotheses, references)
+            ]
+        return [self.score(hypothesis, reference) for hypothesis, reference in pairs]
@@ -0,0 +1,68 @@
+"""
+throughput of RougeEngine and pltrdy rouge on long documents, run from
+metrics/rouge with the dev packages installed:
+python -m tests.benchmark [--pairs N] [--references N]
+"""
+
+import argparse
+import random
+import time
+
+from rouge import Rouge
+from rouge_engine import RougeEngine
+
+SENTENCE_LENGTH = 20
+
+
+def document(rng, vocabulary, length):
+    return " ".join(
+        " ".join(rng.choice(vocabulary) for _ in range(SENTENCE_LENGTH)) + " ."
+        for _ in range(length // SENTENCE_LENGTH)
+    )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--references", type=int, default=50)
+    parser.add_argument("--hypothesis-length", type=int, default=80)
+    parser.add_argument("--reference-length", type=int, default=400)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(3000)]
+    references = [
+        document(rng, vocabulary, args.reference_length)
+        for _ in range(args.references)
+    ]
+    hypotheses = [
+        document(rng, vocabulary, args.hypothesis_length) for _ in range(args.pairs)
+    ]
+    references = [references[i % args.references] for i in range(args.pairs)]
+
+    expected, pltrdy_time = timed(Rouge().get_scores, hypotheses, references)
+    engine = RougeEngine()
+    scores, cold_time = timed(engine.get_scores, hypotheses, references)
+    _, warm_time = timed(engine.get_scores, hypotheses, references)
+    same = all(
+        score[variant] == e[f"rouge-{variant}"]
+        for score, e in zip(scores, expected)
+        for variant in ("1", "2", "l")
+    )
+    print(f"{args.pairs} pairs, scores identical: {same}")
+    for name, seconds in [
+        ("pltrdy rouge", pltrdy_time),
+        ("RougeEngine", cold_time),
+        ("RougeEngine, cached texts", warm_time),
+    ]:
+        print(f"{name:28} {seconds:8.3f}s {args.pairs / seconds:10.1f} pairs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+parity of RougeEngine with pltrdy rouge, the implementation the plugin used
+before, run from metrics/rouge with the dev packages installed:
+python -m unittest discover tests
+"""
+
+import random
+import re
+import unittest
+
+from rouge import Rouge
+from rouge_engine import RougeEngine
+
+VARIANTS = {"1": "rouge-1", "2": "rouge-2", "l": "rouge-l"}
+WORDS = "a b c d e f g h i j".split() + [".", ". ", "  ", " . . "]
+
+
+def random_text(rng, length):
+    return "".join(
+        rng.choice(WORDS) + rng.choice([" ", "", "  "]) for _ in range(length)
+    )
+
+
+class RougeEngineParityTest(unittest.TestCase):
+    def setUp(self):
+        self.rouge = Rouge()
+        self.engine = RougeEngine()
+
+    def assert_same(self, hypothesis, reference):
+        try:
+            expected = self.rouge.get_scores([hypothesis], [reference])[0]
+        except ValueError as error:
+            with self.assertRaisesRegex(ValueError, re.escape(str(error))):
+                self.engine.get_scores([hypothesis], [reference])
+            return
+        (scores,) = self.engine.get_scores([hypothesis], [reference])
+        for variant, key in VARIANTS.items():
+            self.assertEqual(scores[variant], expected[key], (hypothesis, reference))
+
+    def test_random_texts(self):
+        # few distinct words, repeated tokens and sentences of one period
+        # exercise the ties of the LCS backtracking and the n-gram sets
+        rng = random.Random(0)
+        for _ in range(2000):
+            self.assert_same(
+                random_text(rng, rng.randint(1, 40)),
+                random_text(rng, rng.randint(1, 60)),
+            )
+
+    def test_edge_cases(self):
+        for hypothesis, reference in [
+            ("the cat sat on the mat", "the cat sat on the mat"),
+            ("the cat", "a dog"),
+            ("a . b . c", "c . b . a"),
+            ("a a a a", "a"),
+            ("a", "a a a a"),
+            ("", "a"),
+            ("a", ""),
+            (" . ", "a"),
+        ]:
+            with self.subTest(hypothesis=hypothesis, reference=reference):
+                self.assert_same(hypothesis, reference)
+
+    def test_batch_matches_single_pairs(self):
+        rng = random.Random(1)
+        texts = [random_text(rng, rng.randint(5, 30)) for _ in range(200)]
+        pairs = [(rng.choice(texts), rng.choice(texts)) for _ in range(300)]
+        batch = self.engine.get_scores(*zip(*pairs))
+        for (hypothesis, reference), scores in zip(pairs, batch):
+            self.assertEqual(
+                scores, RougeEngine().get_scores([hypothesis], [reference])[0]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import sqlite3
+import time
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+# number of digests per select, below the variable limit of sqlite
+CHUNK_SIZE = 500
+# share of the rows that is kept when the cache is full, so that it is not
+# cleaned up on every insert
+KEEP_RATIO = 0.9
+# number of buffered access times that are written by a lookup, otherwise
+# they are written together with the next insert
+TOUCH_BATCH = 10000
+
+
+def text_digest(text):
+    return sha256(text.encode()).digest()
+
+
+class EmbeddingCache:
+    """
+    persists embeddings in a sqlite database keyed by the model and the sha256
+    digest of the text, so that they survive restarts of the plugin, when
+    there are more than `max_rows` embeddings the least recently used ones are
+    deleted
+
+    the number of rows is counted once and then tracked in memory and the
+    access times of cache hits are buffered and written in batches
+    """
+
+    def __init__(self, path, model, max_rows):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self.max_rows = max_rows
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(model TEXT, digest BLOB, embedding BLOB, used REAL,"
+                " PRIMARY KEY (model, digest)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)"
+            )
+            self.rows = self._count()
+        # digest -> time of the last hit that is not written yet
+        self.touched = {}
+
+    def get(self, digests):
+        """
+        returns the cached embeddings of the digests as a dictionary
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(digests), CHUNK_SIZE):
+                chunk = digests[start : start + CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    "SELECT digest, embedding FROM embeddings "
+                    f"WHERE model = ? AND digest IN ({placeholders})",
+                    [self.model, *chunk],
+                )
+                for digest, embedding in rows:
+                    found[digest] = np.frombuffer(embedding, dtype=np.float32)
+            used = time.time()
+            self.touched.update((digest, used) for digest in found)
+            if len(self.touched) >= TOUCH_BATCH:
+                with self.connection:
+                    self._flush_touched()
+        return found
+
+    def _count(self):
+        (rows,) = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return rows
+
+    def _flush_touched(self):
+        self.connection.executemany(
+            "UPDATE embeddings SET used = ? WHERE model = ? AND digest = ?",
+            [(used, self.model, digest) for digest, used in self.touched.items()],
+        )
+        self.touched = {}
+
+    def _evict(self):
+        # counted again, in case another process shares the database
+        rows = self._count()
+        if rows > self.max_rows:
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE (model, digest) IN "
+                "(SELECT model, digest FROM embeddings ORDER BY used LIMIT ?)",
+                [rows - int(self.max_rows * KEEP_RATIO)],
+            )
+            rows = self._count()
+        self.rows = rows
+
+    def put(self, embeddings):
+        used = time.time()
+        with self.lock, self.connection:
+            # before the eviction, so that recently used rows are kept
+            self._flush_touched()
+            inserted = self.connection.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (self.model, digest, embedding.astype(np.float32).tobytes(), used)
+                    for digest, embedding in embeddings.items()
+                ],
+            ).rowcount
+            self.rows += inserted
+            if self.rows > self.max_rows:
+                self._evict()
@@ -1,14 +1,15 @@
 import os
 
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+from embedding_cache import EmbeddingCache, text_digest
+from sentence_transformers import SentenceTransformer
 
-
-def _paired_cosine_sim(embeddings1, embeddings2):
-    assert len(embeddings1) == len(embeddings2)
-    return [
-        float(util.pytorch_cos_sim(e1, e2)[0][0])
-        for e1, e2 in zip(embeddings1, embeddings2)
-    ]
+# an empty value disables the persistent cache
+CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE", os.path.expanduser("~/.cache/sbert/embeddings.sqlite3")
+)
+# maximal number of cached embeddings, about 3 KB each for all-mpnet-base-v2
+CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 100000))
 
 
 class MetricPlugin:
@@ -16,13 +17,38 @@ class MetricPlugin:
 
     def __init__(self):
         self.model = SentenceTransformer(self.MODEL)
+        self.cache = (
+            EmbeddingCache(CACHE_PATH, self.MODEL, CACHE_SIZE) if CACHE_PATH else None
+        )
+
+    def _embed(self, texts):
+        """
+        returns the normalized embeddings of the unique texts, only texts that
+        are not cached are encoded, encode sorts them by length for batching
+        """
+        digests = {text: text_digest(text) for text in texts}
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get(list(digests.values()))
+        missing = [text for text, digest in digests.items() if digest not in cached]
+        if missing:
+            encoded = self.model.encode(
+                missing, convert_to_numpy=True, normalize_embeddings=True
+            )
+            new = {digests[text]: e for text, e in zip(missing, encoded)}
+            if self.cache is not None:
+                self.cache.put(new)
+            cached.update(new)
+        return {text: cached[digest] for text, digest in digests.items()}
 
     def evaluate(self, batch):
         hypotheses, references = zip(*batch)
-        embeddings1 = self.model.encode(hypotheses, convert_to_tensor=True)
-        embeddings2 = self.model.encode(references, convert_to_tensor=True)
-        cosine_scores = _paired_cosine_sim(embeddings1, embeddings2)
-        return cosine_scores
+        embeddings = self._embed(dict.fromkeys(hypotheses + references))
+        hypothesis_embeddings = np.stack([embeddings[t] for t in hypotheses])
+        reference_embeddings = np.stack([embeddings[t] for t in references])
+        return np.einsum(
+            "ij,ij->i", hypothesis_embeddings, reference_embeddings
+        ).tolist()
 
     def metadata(self):
         return {"model": self.MODEL}
@@ -5,6 +5,7 @@ from os import environ
 
 import uvicorn
 from application import build_application
+from utils.blob_store import blob_resolver_from_env
 
 sys.path.insert(0, "/summary_workbench_plugin_files")
 
@@ -12,6 +13,7 @@ PLUGIN_CONFIG = json.loads(environ["PLUGIN_CONFIG"])
 NUM_THREADS = int(environ.get("THREADS", 1))
 BATCH_SIZE = int(environ.get("BATCH_SIZE", 8))
 CACHE_SIZE = int(environ.get("CACHE_SIZE", 0))
+BLOB_RESOLVER = blob_resolver_from_env()
 
 
 def construct_metric():
@@ -33,11 +35,15 @@ PLUGIN_TYPES = {
 
 plugin_config = PLUGIN_CONFIG
 plugin_config["instancetag"] = str(uuid.uuid4())
+plugin_config["blob_store"] = BLOB_RESOLVER is not None
 
 factory = PLUGIN_TYPES[plugin_config["type"]]()
 
 plugin_config.setdefault("metadata", {})
 plugin_config["metadata"].update(factory.metadata)
+variants = getattr(factory, "variants", None)
+if variants:
+    plugin_config["variants"] = variants
 plugin_config["validators"] = {
     "batch": factory.batch_validator.schema(),
     "required": factory.required_validator.schema(),
@@ -52,6 +58,7 @@ app = build_application(
     num_threads=NUM_THREADS,
     batch_size=BATCH_SIZE,
     cache_size=CACHE_SIZE,
+    blob_resolver=BLOB_RESOLVER,
 )
 
 
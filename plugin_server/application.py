@@ -12,10 +12,16 @@ from workers import Workers
 uvicorn_logger = logging.getLogger("uvicorn")
 
 
-def build_application(func, validator, num_threads=1, batch_size=32, cache_size=0):
+def build_application(
+    func, validator, num_threads=1, batch_size=32, cache_size=0, blob_resolver=None
+):
     app = FastAPI()
     workers = Workers(
-        func, num_threads=num_threads, batch_size=batch_size, cache_size=cache_size
+        func,
+        num_threads=num_threads,
+        batch_size=batch_size,
+        cache_size=cache_size,
+        blob_resolver=blob_resolver,
     )
 
     @app.on_event("startup")
@@ -23,6 +29,7 @@ def build_application(func, validator, num_threads=1, batch_size=32, cache_size=
         uvicorn_logger.info(f"THREADS: {num_threads}")
         uvicorn_logger.info(f"BATCH_SIZE: {batch_size}")
         uvicorn_logger.info(f"CACHE_SIZE: {cache_size}")
+        uvicorn_logger.info(f"BLOB_STORE: {blob_resolver is not None}")
 
     @app.on_event("startup")
     def startup():
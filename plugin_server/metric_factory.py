@@ -18,3 +18,7 @@ class MetricFactory:
             self.metadata = self.plugin.metadata()
         except AttributeError:
             self.metadata = {}
+        try:
+            self.variants = self.plugin.variants()
+        except AttributeError:
+            self.variants = None
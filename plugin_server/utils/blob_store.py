@@ -0,0 +1,83 @@
+import os
+import re
+from pathlib import Path
+from threading import Lock
+
+from cachetools import LRUCache
+
+REF_PREFIX = "sha256:"
+DIGEST_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+class LocalBlobStore:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def read(self, digest):
+        return (self.path / digest[:2] / digest[2:]).read_bytes()
+
+
+BACKENDS = {
+    "local": LocalBlobStore,
+}
+
+
+def backend_from_uri(uri):
+    scheme, _, location = uri.partition(":")
+    try:
+        backend = BACKENDS[scheme]
+    except KeyError:
+        raise ValueError(
+            f"unknown blob store '{scheme}', available are {list(BACKENDS)}"
+        )
+    return backend(location)
+
+
+class BlobResolver:
+    """
+    replaces the references 'sha256:<hex digest>' in the batch of a request
+    by the texts of the blob store that is shared with the gateway, resolved
+    texts are kept in a local cache
+    """
+
+    def __init__(self, backend, cache_size=10000):
+        self.backend = backend
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.lock = Lock()
+
+    def _read(self, digest):
+        if self.cache is not None:
+            with self.lock:
+                text = self.cache.get(digest)
+            if text is not None:
+                return text
+        try:
+            text = self.backend.read(digest).decode()
+        except FileNotFoundError:
+            raise ValueError(f"the blob {REF_PREFIX}{digest} does not exist")
+        if self.cache is not None:
+            with self.lock:
+                self.cache[digest] = text
+        return text
+
+    def _resolve(self, element):
+        if isinstance(element, (list, tuple)):
+            return type(element)(self._resolve(e) for e in element)
+        if isinstance(element, str) and element.startswith(REF_PREFIX):
+            digest = element[len(REF_PREFIX) :]
+            if DIGEST_PATTERN.fullmatch(digest):
+                return self._read(digest)
+        return element
+
+    def resolve(self, data):
+        return {**data, "batch": [self._resolve(e) for e in data["batch"]]}
+
+
+def blob_resolver_from_env():
+    uri = os.environ.get("BLOB_STORE")
+    if not uri:
+        return None
+    return BlobResolver(
+        backend_from_uri(uri),
+        cache_size=int(os.environ.get("BLOB_CACHE_SIZE", 10000)),
+    )
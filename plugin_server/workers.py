@@ -108,12 +108,15 @@ class Work:
 
 
 class Workers:
-    def __init__(self, func, num_threads=1, batch_size=32, cache_size=0):
+    def __init__(
+        self, func, num_threads=1, batch_size=32, cache_size=0, blob_resolver=None
+    ):
         assert num_threads > 0, "the number of threads has to be at least 1"
         self.batcher = Batcher(batch_size)
         self.cache = Cache(cache_size)
         self.num_threads = num_threads
         self.func = func
+        self.blob_resolver = blob_resolver
         self.cache_size = cache_size
         self.curr_processing_size = 0
         self.worker_process = None
@@ -144,6 +147,13 @@ class Workers:
     def num_waiting_elements(self):
         return self.batcher.num_waiting_elements()
 
+    def resolve(self, batch):
+        # the references are resolved after the cache lookup, so the cache
+        # keys of the elements are computed from the short references
+        if self.blob_resolver is None:
+            return batch
+        return self.blob_resolver.resolve(batch)
+
     def submit(self, event_box, data):
         work = Work(event_box, data, cache=self.cache)
         if not work.is_done():
@@ -154,7 +164,7 @@ class Workers:
         size = len(batch["batch"])
         self.curr_processing_size += size
         try:
-            thread = CancableThread(target=lambda: self.func(**batch))
+            thread = CancableThread(target=lambda: self.func(**self.resolve(batch)))
             try:
                 results = await thread.run_until_finish_or_event(work.event_box)
             except Exception as e:
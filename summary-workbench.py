@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+import asyncio
+import json
+import random
+from pathlib import Path
+
+import aiohttp
 import requests
 
 
@@ -43,9 +49,244 @@ class Api:
         )
 
 
-if __name__ == "__main__":
-    import json
+class RetryableError(Exception):
+    pass
+
+
+class CheckpointMismatchError(Exception):
+    pass
+
+
+def read_chunks(path, chunk_size):
+    """
+    lazily reads the jsonl file and yields chunks of lines together with the
+    byte offsets where the chunk starts and ends
+    """
+    with open(path, "rb") as f:
+        lines = []
+        start = offset = 0
+        for raw_line in f:
+            offset += len(raw_line)
+            if raw_line.strip():
+                lines.append(raw_line.decode("utf-8"))
+            if len(lines) == chunk_size:
+                yield start, offset, lines
+                lines = []
+                start = offset
+        if lines:
+            yield start, offset, lines
+
+
+def group_lines(lines, first_line):
+    entries = [None] * len(lines)
+    groups = {}
+    for i, line in enumerate(lines):
+        try:
+            example = json.loads(line)
+            reference = example["reference"]
+        except (json.JSONDecodeError, TypeError, KeyError) as e:
+            entries[i] = {"line": first_line + i, "error": f"invalid line: {e!r}"}
+            continue
+        hypotheses = {
+            key: value
+            for key, value in example.items()
+            if key not in {"document", "reference"}
+        }
+        groups.setdefault(tuple(hypotheses), []).append((i, hypotheses, reference))
+    return entries, groups
+
+
+class Checkpoint:
+    """
+    stores the results of finished chunks in a jsonl file next to the output,
+    the first line describes the run so that a checkpoint is only resumed
+    with the same input, metrics and chunk size
+    """
+
+    def __init__(self, path, header):
+        self.path = Path(path)
+        self.header = header
+        self.chunks = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                stored_header = json.loads(f.readline() or "null")
+                if stored_header != header:
+                    raise CheckpointMismatchError(
+                        f"the checkpoint {self.path} belongs to a different run, remove it to start again"
+                    )
+                for line in f:
+                    try:
+                        chunk = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be incomplete if the run was killed
+                        break
+                    self.chunks[chunk["index"]] = chunk
+            self.file = open(self.path, "a")
+        else:
+            self.file = open(self.path, "w")
+            self.file.write(json.dumps(header) + "\n")
+            self.file.flush()
+
+    def get(self, index, start, end):
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            return None
+        if (chunk["start"], chunk["end"]) != (start, end):
+            raise CheckpointMismatchError(
+                f"chunk {index} of the checkpoint does not match the input file"
+            )
+        return chunk["entries"]
+
+    def add(self, index, start, end, entries):
+        chunk = {"index": index, "start": start, "end": end, "entries": entries}
+        self.file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def remove(self):
+        self.file.close()
+        self.path.unlink()
+
+    def close(self):
+        self.file.close()
+
+
+class CorpusEvaluator:
+    """
+    evaluates a jsonl corpus (e.g. the output of jsonl_converter.py) in chunks
+    with `concurrency` requests in flight over one connection pool
+
+    failed requests are retried with exponential backoff, finished chunks are
+    written to a checkpoint so that an interrupted run resumes with the
+    missing chunks and the output is written in the order of the input
+    """
+
+    def __init__(
+        self, host, metrics, chunk_size=64, concurrency=8, retries=5, timeout=600
+    ):
+        self.host = host
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+
+    async def _post(self, session, json):
+        async with session.post(f"{self.host}/api/evaluate", json=json) as response:
+            if response.status == 429 or response.status >= 500:
+                raise RetryableError(f"status {response.status}")
+            return await response.json(content_type=None)
 
+    async def _evaluate(self, session, hypotheses, references):
+        body = {
+            "metrics": self.metrics,
+            "hypotheses": hypotheses,
+            "references": references,
+        }
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._post(session, body)
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(2**attempt + random.random())
+
+    async def evaluate_chunk(self, session, lines, first_line):
+        entries, groups = group_lines(lines, first_line)
+        for models, group in groups.items():
+            indices, hypotheses, references = zip(*group)
+            hypotheses = {model: [h[model] for h in hypotheses] for model in models}
+            response = await self._evaluate(session, hypotheses, list(references))
+            if "errors" in response and "data" not in response:
+                for i in indices:
+                    entries[i] = {"line": first_line + i, "errors": response["errors"]}
+                continue
+            data = response["data"]
+            for j, i in enumerate(indices):
+                entry = {
+                    "line": first_line + i,
+                    "scores": {
+                        metric: {model: values[j] for model, values in scores.items()}
+                        for metric, scores in data["scores"].items()
+                    },
+                }
+                if data.get("errors"):
+                    entry["errors"] = data["errors"]
+                entries[i] = entry
+        return entries
+
+    async def run(self, infile, outfile, progress=None):
+        header = {
+            "input": str(Path(infile).resolve()),
+            "metrics": self.metrics,
+            "chunk_size": self.chunk_size,
+        }
+        checkpoint = Checkpoint(f"{outfile}.checkpoint", header)
+        finished = {}
+        next_index = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def write_finished(out):
+            nonlocal next_index
+            while next_index in finished:
+                for entry in finished.pop(next_index):
+                    out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                next_index += 1
+            out.flush()
+
+        async def process(session, index, start, end, lines, first_line):
+            try:
+                entries = await self.evaluate_chunk(session, lines, first_line)
+                checkpoint.add(index, start, end, entries)
+                finished[index] = entries
+                if progress is not None:
+                    progress(end - start)
+            finally:
+                semaphore.release()
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        tasks = []
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                with open(outfile, "w") as out:
+                    first_line = 0
+                    for index, (start, end, lines) in enumerate(
+                        read_chunks(infile, self.chunk_size)
+                    ):
+                        entries = checkpoint.get(index, start, end)
+                        if entries is not None:
+                            finished[index] = entries
+                            if progress is not None:
+                                progress(end - start)
+                        else:
+                            await semaphore.acquire()
+                            for task in tasks:
+                                if task.done():
+                                    # raises the error of a failed chunk
+                                    task.result()
+                            tasks = [task for task in tasks if not task.done()]
+                            tasks.append(
+                                asyncio.create_task(
+                                    process(
+                                        session, index, start, end, lines, first_line
+                                    )
+                                )
+                            )
+                        write_finished(out)
+                        first_line += len(lines)
+                    await asyncio.gather(*tasks)
+                    write_finished(out)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            checkpoint.close()
+            raise
+        checkpoint.remove()
+
+
+if __name__ == "__main__":
     def json_print(data):
         print(json.dumps(data))
 
@@ -188,4 +429,61 @@ if __name__ == "__main__":
                     print(colored(f"{summarizer}:", "green"))
                     print(clean_lines(summary))
 
+    @main.command(
+        help="evaluate a jsonl corpus (e.g. the output of jsonl_converter.py) in chunks and write the scores of every line to OUTFILE, an interrupted run is resumed from OUTFILE.checkpoint"
+    )
+    @click.option(
+        "--metrics",
+        required=True,
+        help="comma separated list of metrics or a json object with the arguments of every metric",
+    )
+    @click.option(
+        "--chunk-size", default=64, show_default=True, help="lines per request"
+    )
+    @click.option(
+        "--concurrency",
+        default=8,
+        show_default=True,
+        help="number of requests in flight",
+    )
+    @click.option(
+        "--retries",
+        default=5,
+        show_default=True,
+        help="number of retries of a failed request",
+    )
+    @click.option(
+        "--timeout",
+        default=600,
+        show_default=True,
+        help="timeout of a request in seconds",
+    )
+    @click.argument("infile", type=click.Path(exists=True, dir_okay=False))
+    @click.argument("outfile", type=click.Path(dir_okay=False))
+    @click.pass_context
+    def evaluate_corpus(
+        ctx, metrics, chunk_size, concurrency, retries, timeout, infile, outfile
+    ):
+        try:
+            metrics = json.loads(metrics)
+        except json.JSONDecodeError:
+            metrics = [key.strip() for key in metrics.split(",") if key.strip()]
+        if isinstance(metrics, list):
+            metrics = {key: {} for key in metrics}
+        evaluator = CorpusEvaluator(
+            ctx.obj["api"].host,
+            metrics,
+            chunk_size=chunk_size,
+            concurrency=concurrency,
+            retries=retries,
+            timeout=timeout,
+        )
+        with click.progressbar(
+            length=Path(infile).stat().st_size, label="evaluating"
+        ) as bar:
+            try:
+                asyncio.run(evaluator.run(infile, outfile, bar.update))
+            except CheckpointMismatchError as e:
+                raise click.ClickException(str(e))
+
     main()